@@ -1,10 +1,10 @@
 import requests
 import os
 import click
-import numpy as np
 import rasterio
 import geopandas as gpd
-from floodpipeline.forecast import clip_raster, merge_rasters
+from rasterio.features import geometry_mask
+from floodpipeline.forecast import clip_raster, merge_rasters_to
 from floodpipeline.load import Load
 from floodpipeline.settings import Settings
 from floodpipeline.secrets import Secrets
@@ -101,28 +101,36 @@ def add_flood_maps(country):
                 flood_map_clipped_filepath = f"data/updates/{flood_map_file}".replace(
                     ".tif", "_clipped.tif"
                 )
-                clip, out_meta = clip_raster(
+                flood_map, flood_map_meta = clip_raster(
                     flood_map_filepath, [box(*country_gdf.total_bounds)]
                 )
-                with rasterio.open(flood_map_clipped_filepath, "w", **out_meta) as dest:
-                    dest.write(clip)
-                # mask permanent water bodies
-                clip, out_meta = clip_raster(
-                    flood_map_clipped_filepath,
+                # mask permanent water bodies in the clipped array
+                water = geometry_mask(
                     lake_country_gdf["geometry"].tolist(),
+                    out_shape=flood_map.shape[1:],
+                    transform=flood_map_meta["transform"],
                     invert=True,
                 )
-                with rasterio.open(flood_map_clipped_filepath, "w", **out_meta) as dest:
-                    dest.write(clip)
+                flood_map[:, water] = (
+                    flood_map_meta["nodata"]
+                    if flood_map_meta["nodata"] is not None
+                    else 0
+                )
+                with rasterio.open(
+                    flood_map_clipped_filepath, "w", **flood_map_meta
+                ) as dest:
+                    dest.write(flood_map)
                 flood_map_filepaths.append(flood_map_clipped_filepath)
 
             # merge flood maps
             merged_raster_filepath = f"data/updates/flood_map_{country_name}_RP{rp}.tif"
-            mosaic, out_meta = merge_rasters(flood_map_filepaths)
-            mosaic = np.nan_to_num(mosaic)
-            out_meta.update(dtype=rasterio.float32, count=1, compress="lzw")  # compress
-            with rasterio.open(merged_raster_filepath, "w", **out_meta) as dest:
-                dest.write(mosaic.astype(rasterio.float32))
+            merge_rasters_to(
+                flood_map_filepaths,
+                merged_raster_filepath,
+                nan_to_num=True,
+                dtype=rasterio.float32,
+                compress="lzw",
+            )
 
             # save to blob storage
             load.save_to_blob(
@@ -1,6 +1,7 @@
 import requests
 import os
 import urllib.request
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import pandas as pd
 from bs4 import BeautifulSoup
@@ -37,6 +38,22 @@ settings = Settings("config/config.yaml")
 load = Load(settings=settings, secrets=secrets)
 
 
+def compute_zonal_max(filepath: str, gdf: gpd.GeoDataFrame) -> list:
+    """Compute the maximum value of the raster within each geometry"""
+    with rasterio.open(filepath) as src:
+        raster_array = src.read(1)
+        transform = src.transform
+    stats = zonal_stats(
+        gdf,
+        raster_array,
+        affine=transform,
+        stats=["max"],
+        all_touched=True,
+        nodata=0.0,
+    )
+    return [stat["max"] for stat in stats]
+
+
 @click.command()
 @click.option("--country", "-c", help="country ISO3", default="all")
 def add_flood_thresholds(country):
@@ -78,24 +95,15 @@ def add_flood_thresholds(country):
             country_gdf = load.get_adm_boundaries(
                 country=country_name, adm_level=int(adm_level)
             )
-            for rp, filename in flood_thresholds_files.items():
-                with rasterio.open(filename) as src:
-                    raster_array = src.read(1)
-                    transform = src.transform
-                # Perform zonal statistics
-                stats = zonal_stats(
-                    country_gdf,
-                    raster_array,
-                    affine=transform,
-                    stats=["max", "median"],
-                    all_touched=True,
-                    nodata=0.0,
-                )
-                df = pd.DataFrame(stats).rename(
-                    columns={"max": f"max_{rp}", "median": f"median_{rp}"}
-                )
-                country_gdf = pd.concat([country_gdf, df], axis=1)
-            for ix, row in country_gdf.iterrows():
+            # Perform zonal statistics, one return period per process
+            with ProcessPoolExecutor() as pool:
+                futures = {
+                    rp: pool.submit(compute_zonal_max, filename, country_gdf)
+                    for rp, filename in flood_thresholds_files.items()
+                }
+                for rp, future in futures.items():
+                    country_gdf[f"max_{rp}"] = future.result()
+            for row in country_gdf.drop(columns="geometry").to_dict("records"):
                 ttdu = ThresholdDataUnit(
                     adm_level=int(adm_level),
                     pcode=row[f"adm{adm_level}_pcode"],
@@ -1,4 +1,3 @@
-from floodpipeline.pipeline import Pipeline
 from floodpipeline.secrets import Secrets
 from floodpipeline.settings import Settings
 from datetime import date, datetime, timedelta
@@ -31,6 +30,9 @@ import click
 def run_river_flood_pipeline(
     country, prepare, extract, forecast, send, save, datetimestart, datetimeend, debug
 ):
+    # import the pipeline (and its geospatial libraries) only when running it
+    from floodpipeline.pipeline import Pipeline
+
     datetimestart = datetime.strptime(datetimestart, "%Y-%m-%dT%H:%M:%S")
     datetimeend = datetime.strptime(datetimeend, "%Y-%m-%dT%H:%M:%S")
     pipe = Pipeline(
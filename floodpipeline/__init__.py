@@ -3,6 +3,7 @@ __all__ = [
     "load",
     "pipeline",
     "forecast",
+    "raster",
     "secrets",
     "data"
 ]
@@ -33,7 +33,7 @@ class DischargeDataUnit(AdminDataUnit):
         self.lead_time: int = kwargs.get("lead_time")
         self.discharge_ensemble: List[float] = kwargs.get("discharge_ensemble", None)
         self.discharge_mean: float = kwargs.get("discharge_mean", None)
-        if hasattr(self.discharge_ensemble, "__iter__"):
+        if self.discharge_mean is None and hasattr(self.discharge_ensemble, "__iter__"):
             self.compute_mean()
 
     def compute_mean(self):
@@ -51,7 +51,7 @@ class DischargeStationDataUnit(StationDataUnit):
         self.lead_time: int = kwargs.get("lead_time")
         self.discharge_ensemble: List[float] = kwargs.get("discharge_ensemble", None)
         self.discharge_mean: float = kwargs.get("discharge_mean", None)
-        if hasattr(self.discharge_ensemble, "__iter__"):
+        if self.discharge_mean is None and hasattr(self.discharge_ensemble, "__iter__"):
             self.compute_mean()
 
     def compute_mean(self):
@@ -143,9 +143,120 @@ class ThresholdStationDataUnit(StationDataUnit):
             return threshold["threshold_value"]
 
 
-class AdminDataSet:
+class DataSet:
+    """
+    Base class for data sets, data units are indexed by key_attribute and lead time.
+    The index is rebuilt when data_units is set or its length changes, and when a
+    lookup finds a data unit with another key or lead time or (in get_data_unit)
+    misses, so that data units replaced or changed in place are found too
+    """
+
+    key_attribute: str = None
+
+    def __init__(
+        self,
+        country: str = None,
+        timestamp: datetime = datetime.now(),
+        data_units: list = None,
+    ):
+        self.country = country
+        self.timestamp = timestamp
+        self.data_units = data_units
+
+    @property
+    def data_units(self) -> list:
+        """Data units, setting them rebuilds the index"""
+        return self.__data_units
+
+    @data_units.setter
+    def data_units(self, data_units: list):
+        self.__data_units = data_units
+        self.__index = {}
+        for i, data_unit in enumerate(data_units or []):
+            self.__add_to_index(i, data_unit)
+        self.__indexed_len = len(data_units or [])
+
+    def __get_index(self) -> dict:
+        """Get index of data units, rebuild it if data units were appended outside"""
+        if self.__indexed_len != len(self.data_units or []):
+            self.data_units = self.data_units
+        return self.__index
+
+    def __add_to_index(self, i: int, data_unit):
+        """
+        Add data unit position by (key, lead time) and by key,
+        keep the first one if duplicated
+        """
+        key = getattr(data_unit, self.key_attribute)
+        lead_time = getattr(data_unit, "lead_time", None)
+        self.__index.setdefault((key, lead_time), i)
+        self.__index.setdefault(key, i)
+
+    def get_lead_times(self):
+        """Return list of unique lead times"""
+        return list(
+            set([x.lead_time for x in self.data_units if hasattr(x, "lead_time")])
+        )
+
+    def __is_indexed_at(self, index_key, i: int) -> bool:
+        """Check if the data unit at position i still matches the index key"""
+        if i is None or i >= len(self.data_units):
+            return False
+        data_unit = self.data_units[i]
+        if isinstance(index_key, tuple):
+            key, lead_time = index_key
+            return (
+                getattr(data_unit, self.key_attribute) == key
+                and getattr(data_unit, "lead_time", None) == lead_time
+            )
+        return getattr(data_unit, self.key_attribute) == index_key
+
+    def __find(self, index_key, rebuild_on_miss: bool = True):
+        """
+        Get position of data unit by index key, rebuild the index if it points to
+        another data unit or, optionally, if the key is not found
+        """
+        i = self.__get_index().get(index_key)
+        if i is None and not rebuild_on_miss:
+            return None
+        if not self.__is_indexed_at(index_key, i):
+            self.data_units = self.data_units
+            i = self.__index.get(index_key)
+        return i
+
+    def get_data_unit(self, key: str, lead_time: int = None):
+        """Get data unit by key and optionally by lead time"""
+        if not self.data_units:
+            raise ValueError("Data units not found")
+        i = self.__find((key, lead_time) if lead_time is not None else key)
+        if i is None:
+            raise ValueError(
+                f"Data unit with {self.key_attribute} {key} and lead_time {lead_time} not found"
+            )
+        else:
+            return self.data_units[i]
+
+    def upsert_data_unit(self, data_unit):
+        """Add data unit; if it already exists, update it"""
+        if not self.data_units:
+            self.data_units = [data_unit]
+        key = getattr(data_unit, self.key_attribute)
+        if hasattr(data_unit, "lead_time"):
+            key = (key, data_unit.lead_time)
+        i = self.__find(key, rebuild_on_miss=False)
+        if i is None:
+            self.data_units.append(data_unit)
+            self.__add_to_index(len(self.data_units) - 1, data_unit)
+            self.__indexed_len = len(self.data_units)
+        else:
+            self.data_units[i] = data_unit
+
+
+class AdminDataSet(DataSet):
     """Base class for admin data sets"""
 
+    key_attribute = "pcode"
+
     def __init__(
         self,
         country: str = None,
@@ -153,10 +264,8 @@ class AdminDataSet:
         adm_levels: List[int] = None,
         data_units: List[AdminDataUnit] = None,
     ):
-        self.country = country
-        self.timestamp = timestamp
+        super().__init__(country, timestamp, data_units)
         self.adm_levels = adm_levels
-        self.data_units = data_units
 
     def get_pcodes(self, adm_level: int = None):
         """Return list of unique pcodes, optionally filtered by adm_level"""
@@ -167,12 +276,6 @@ class AdminDataSet:
                 set([x.pcode for x in self.data_units if x.adm_level == adm_level])
             )
 
-    def get_lead_times(self):
-        """Return list of unique lead times"""
-        return list(
-            set([x.lead_time for x in self.data_units if hasattr(x, "lead_time")])
-        )
-
     def get_data_units(self, lead_time: int = None, adm_level: int = None):
         """Return list of data units filtered by lead time and/or admin level"""
         if not self.data_units:
@@ -193,53 +296,7 @@ class AdminDataSet:
 
     def get_data_unit(self, pcode: str, lead_time: int = None) -> AdminDataUnit:
         """Get data unit by pcode and optionally by lead time"""
-        if not self.data_units:
-            raise ValueError("Data units not found")
-        if lead_time is not None:
-            bdu = next(
-                filter(
-                    lambda x: x.pcode == pcode and x.lead_time == lead_time,
-                    self.data_units,
-                ),
-                None,
-            )
-        else:
-            bdu = next(
-                filter(lambda x: x.pcode == pcode, self.data_units),
-                None,
-            )
-        if not bdu:
-            raise ValueError(
-                f"Data unit with pcode {pcode} and lead_time {lead_time} not found"
-            )
-        else:
-            return bdu
-
-    def upsert_data_unit(self, data_unit: AdminDataUnit):
-        """Add data unit; if it already exists, update it"""
-        if not self.data_units:
-            self.data_units = [data_unit]
-        if hasattr(data_unit, "lead_time"):
-            bdu = next(
-                filter(
-                    lambda x: x[1].pcode == data_unit.pcode
-                    and x[1].lead_time == data_unit.lead_time,
-                    enumerate(self.data_units),
-                ),
-                None,
-            )
-        else:
-            bdu = next(
-                filter(
-                    lambda x: x[1].pcode == data_unit.pcode,
-                    enumerate(self.data_units),
-                ),
-                None,
-            )
-        if not bdu:
-            self.data_units.append(data_unit)
-        else:
-            self.data_units[bdu[0]] = data_unit
+        return super().get_data_unit(pcode, lead_time)
 
     def is_any_triggered(self):
         """Check if any data unit is triggered"""
@@ -250,77 +307,24 @@ class AdminDataSet:
         return any([x.triggered for x in self.data_units])
 
 
-class StationDataSet:
+class StationDataSet(DataSet):
     """Base class for station data sets"""
 
+    key_attribute = "station_code"
+
     def __init__(
         self,
         country: str = None,
         timestamp: datetime = datetime.now(),
         data_units: List[StationDataUnit] = None,
     ):
-        self.country = country
-        self.timestamp = timestamp
-        self.data_units = data_units
+        super().__init__(country, timestamp, data_units)
 
     def get_data_unit(
         self, station_code: str, lead_time: int = None
     ) -> StationDataUnit:
         """Get data unit by station_code and optionally by lead time"""
-        if not self.data_units:
-            raise ValueError("Data units not found")
-        if lead_time:
-            bdu = next(
-                filter(
-                    lambda x: x.station_code == station_code
-                    and x.lead_time == lead_time,
-                    self.data_units,
-                ),
-                None,
-            )
-        else:
-            bdu = next(
-                filter(lambda x: x.station_code == station_code, self.data_units),
-                None,
-            )
-        if not bdu:
-            raise ValueError(
-                f"Data unit with station_code {station_code} and lead_time {lead_time} not found"
-            )
-        else:
-            return bdu
-
-    def upsert_data_unit(self, data_unit: StationDataUnit):
-        """Add data unit; if it already exists, update it"""
-        if not self.data_units:
-            self.data_units = [data_unit]
-        if hasattr(data_unit, "lead_time"):
-            bdu = next(
-                filter(
-                    lambda x: x[1].station_code == data_unit.station_code
-                    and x[1].lead_time == data_unit.lead_time,
-                    enumerate(self.data_units),
-                ),
-                None,
-            )
-        else:
-            bdu = next(
-                filter(
-                    lambda x: x[1].station_code == data_unit.station_code,
-                    enumerate(self.data_units),
-                ),
-                None,
-            )
-        if not bdu:
-            self.data_units.append(data_unit)
-        else:
-            self.data_units[bdu[0]] = data_unit
-
-    def get_lead_times(self):
-        """Return list of unique lead times"""
-        return list(
-            set([x.lead_time for x in self.data_units if hasattr(x, "lead_time")])
-        )
+        return super().get_data_unit(station_code, lead_time or None)
 
     def get_station_codes(self):
         """Return list of unique station codes"""
@@ -6,32 +6,126 @@ from floodpipeline.data import (
     DischargeStationDataUnit,
 )
 from floodpipeline.load import Load
+from floodpipeline.raster import (
+    get_raster_window,
+    get_zone_pixels,
+    zonal_max,
+    sample_raster,
+)
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-import time
-import geopandas as gpd
-import pandas as pd
-import xarray as xr
-from rasterstats import zonal_stats
+import numpy as np
+import netCDF4
 import rasterio
 import logging
 import itertools
-from typing import List
-import urllib.request
-import ftplib
-import copy
 
 supported_sources = ["GloFAS"]
 
+# the netCDF/HDF5 C libraries are not thread-safe
+netcdf_lock = threading.Lock()
+
 
-def slice_netcdf_file(nc_file: xr.Dataset, country_bounds: list):
-    """Slice the netcdf file to the bounding box"""
+def slice_netcdf_file(
+    nc_file: netCDF4.Dataset, country_bounds: list, no_time_steps: int = None
+):
+    """
+    Slice the discharge variable of the netcdf file to the bounding box and,
+    optionally, to the first time steps; return the sliced variable (time, lat, lon)
+    and its longitude and latitude
+    """
     min_lon = country_bounds[0]  # Minimum longitude
     max_lon = country_bounds[2]  # Maximum longitude
     min_lat = country_bounds[1]  # Minimum latitude
     max_lat = country_bounds[3]  # Maximum latitude
-    var_data = nc_file.sel(lon=slice(min_lon, max_lon), lat=slice(max_lat, min_lat))
-    return var_data
+    lon = nc_file.variables["lon"][:].data
+    lat = nc_file.variables["lat"][:].data
+    lon_idx = np.flatnonzero((lon >= min_lon) & (lon <= max_lon))
+    lat_idx = np.flatnonzero((lat >= min_lat) & (lat <= max_lat))
+    lon_slice = slice(lon_idx[0], lon_idx[-1] + 1)
+    lat_slice = slice(lat_idx[0], lat_idx[-1] + 1)
+    variable = get_netcdf_variable(nc_file)
+    # Read a single hyperslab, masked (fill) values become NaN
+    var_data = np.ma.filled(
+        variable[:no_time_steps, lat_slice, lon_slice].astype(np.float32), np.nan
+    )
+    return var_data, lon[lon_slice], lat[lat_slice]
+
+
+def get_netcdf_variable(nc_file: netCDF4.Dataset) -> netCDF4.Variable:
+    """Get the gridded (time, lat, lon) variable of the netcdf file"""
+    for variable in nc_file.variables.values():
+        if variable.dimensions[-2:] == ("lat", "lon") and variable.ndim == 3:
+            return variable
+    raise ValueError("no gridded (time, lat, lon) variable found in netcdf file")
+
+
+def write_netcdf_file(
+    filename: str,
+    nc_file: netCDF4.Dataset,
+    var_data: np.ndarray,
+    lon: np.ndarray,
+    lat: np.ndarray,
+):
+    """
+    Write sliced data to a netcdf file with the variable, coordinates and attributes
+    of the original netcdf file; uncompressed and contiguous (NETCDF3) for fast rereads
+    """
+    variable = get_netcdf_variable(nc_file)
+    time_dim = variable.dimensions[0]
+    encoding_attrs = ["_FillValue", "missing_value", "scale_factor", "add_offset"]
+    with netCDF4.Dataset(filename, "w", format="NETCDF3_64BIT_OFFSET") as nc_out:
+        nc_out.createDimension(time_dim, var_data.shape[0])
+        nc_out.createDimension("lat", lat.size)
+        nc_out.createDimension("lon", lon.size)
+        coords = {"lat": lat, "lon": lon}
+        if time_dim in nc_file.variables:
+            coords[time_dim] = nc_file.variables[time_dim][: var_data.shape[0]]
+        for name, values in coords.items():
+            # NETCDF3 does not support 64-bit integers
+            dtype = nc_file.variables[name].dtype
+            if dtype.kind in "iu" and dtype.itemsize > 4:
+                dtype = np.float64
+            coord = nc_out.createVariable(name, dtype, (name,))
+            coord.setncatts(
+                {
+                    key: value
+                    for key, value in nc_file.variables[name].__dict__.items()
+                    if key not in encoding_attrs
+                }
+            )
+            coord[:] = values
+        var_out = nc_out.createVariable(
+            variable.name,
+            np.float32,
+            variable.dimensions,
+            fill_value=np.float32(np.nan),
+        )
+        var_out.setncatts(
+            {
+                key: value
+                for key, value in variable.__dict__.items()
+                if key not in encoding_attrs
+            }
+        )
+        var_out[:] = var_data
+
+
+def get_netcdf_transform(nc_file: netCDF4.Dataset, lon: np.ndarray, lat: np.ndarray):
+    """
+    Get the affine transform of a slice of the regular grid of the netcdf file
+    from its lon/lat pixel centers; the resolution is taken from the full grid,
+    since the slice may be a single row or column
+    """
+    grid_lon = nc_file.variables["lon"][:].data
+    grid_lat = nc_file.variables["lat"][:].data
+    res_lon = (grid_lon[-1] - grid_lon[0]) / (grid_lon.size - 1)
+    res_lat = (grid_lat[0] - grid_lat[-1]) / (grid_lat.size - 1)
+    return rasterio.transform.from_origin(
+        lon[0] - res_lon / 2, lat[0] + res_lat / 2, res_lon, res_lat
+    )
 
 
 class Extract:
@@ -58,6 +152,7 @@ class Extract:
             self.set_secrets(secrets)
             self.load.set_secrets(secrets)
         self.data = data
+        self.glofas_data = {}
 
     def set_settings(self, settings):
         """Set settings"""
@@ -139,110 +234,144 @@ class Extract:
         #     )
 
         # Extract data from NetCDF files
-        logging.info("Extract admin-level river discharge from GloFAS data")
+        logging.info("Extract river discharge from GloFAS data")
 
-        discharges = {}
-        for adm_level in self.data.discharge_admin.adm_levels:
-            country_gdf = self.load.get_adm_boundaries(
+        adm_levels = self.data.discharge_admin.adm_levels
+        country_gdfs = {
+            adm_level: self.load.get_adm_boundaries(
                 country=country, adm_level=adm_level
             )
-            for ensemble in range(0, no_ens):
-                filename = os.path.join(
-                    self.inputPathGrid,
-                    f"GloFAS_{date}_{country}_{ensemble}.nc",
+            for adm_level in adm_levels
+        }
+        pcodes = {
+            adm_level: country_gdfs[adm_level][f"adm{adm_level}_pcode"].tolist()
+            for adm_level in adm_levels
+        }
+        adm_bounds = np.array([gdf.total_bounds for gdf in country_gdfs.values()])
+        country_bounds = [
+            *adm_bounds[:, :2].min(axis=0),
+            *adm_bounds[:, 2:].max(axis=0),
+        ]
+
+        # get station information from preloaded thresholds
+        stations = [
+            self.data.threshold_station.get_data_unit(station_code=station_code)
+            for station_code in self.data.threshold_station.get_station_codes()
+        ]
+        coords = [(float(station.lon), float(station.lat)) for station in stations]
+
+        # River discharge per admin division / station, lead time and ensemble member
+        discharges = {
+            adm_level: np.zeros((len(pcodes[adm_level]), 7, no_ens), dtype=np.float32)
+            for adm_level in adm_levels
+        }
+        discharges_stations = np.zeros((len(stations), 7, no_ens), dtype=np.float32)
+        ensembles_found = np.zeros(no_ens, dtype=bool)
+        window_cubes = {}
+        for ensemble in range(0, no_ens):
+            glofas_data = self.__get_glofas_data(country, date, ensemble)
+            if glofas_data is None:
+                logging.warning(
+                    f"Country-specific GloFAS data of ensemble {ensemble} not found, skipping"
                 )
-                if not os.path.exists(filename):
-                    logging.warning(
-                        f"Country-specific NetCDF file of ensemble {ensemble} not found, skipping"
-                    )
-                    continue
-                for lead_time in range(1, 8):
-                    with rasterio.open(filename) as src:
-                        raster_array = src.read(lead_time)
-                        transform = src.transform
-                    # Perform zonal statistics for admin divisions
-                    stats = zonal_stats(
-                        country_gdf,
-                        raster_array,
-                        affine=transform,
-                        stats=["max", "median"],
-                        all_touched=True,
-                        nodata=0.0,
-                    )
-                    dis = pd.concat([country_gdf, pd.DataFrame(stats)], axis=1)
-                    for ix, row in dis.iterrows():
-                        key = f'{row[f"adm{adm_level}_pcode"]}_{lead_time}'
-                        if key not in discharges.keys():
-                            discharges[key] = []
-                        discharges[key].append(
-                            row["max"] if not pd.isna(row["max"]) else 0.0
-                        )
+                continue
+            ensembles_found[ensemble] = True
+            raster_cube, transform = glofas_data
+            # sliced data kept in memory is only extracted once
+            self.glofas_data.pop((country, date, ensemble), None)
+
+            # Keep the country window, grouped by raster grid
+            window = get_raster_window(transform, raster_cube.shape[1:], country_bounds)
+            grid = (
+                (window.height, window.width),
+                rasterio.windows.transform(window, transform),
+            )
+            window_cubes.setdefault(grid, {})[ensemble] = raster_cube[
+                (slice(None), *window.toslices())
+            ]
+
+            # Extract data for all stations and lead times at once
+            discharges_stations[:, :, ensemble] = sample_raster(
+                raster_cube, transform, coords
+            )
+
+        if not ensembles_found.any():
+            raise FileNotFoundError(
+                f"No GloFAS data found for country {country} on {date}, "
+                f"none of the {no_ens} ensemble members is available"
+            )
+
+        # Rasterize admin divisions once per raster grid and perform zonal statistics
+        # for all ensemble members and lead times at once
+        for grid, ensemble_cubes in window_cubes.items():
+            ensembles = list(ensemble_cubes.keys())
+            ensemble_cube = np.concatenate(list(ensemble_cubes.values()))
+            for adm_level in adm_levels:
+                zones = get_zone_pixels(country_gdfs[adm_level].geometry, *grid)
+                maxes = zonal_max(ensemble_cube, zones)
+                discharges[adm_level][:, :, ensembles] = maxes.reshape(
+                    len(zones), len(ensembles), 7
+                ).transpose(0, 2, 1)
 
+        # Ensemble means of all admin divisions / stations and lead times at once
+        discharges = {
+            adm_level: discharges[adm_level][:, :, ensembles_found]
+            for adm_level in adm_levels
+        }
+        discharges_stations = discharges_stations[:, :, ensembles_found]
+        discharges_mean = {
+            adm_level: discharges[adm_level].mean(axis=2, dtype=np.float64)
+            for adm_level in adm_levels
+        }
+        discharges_stations_mean = discharges_stations.mean(axis=2, dtype=np.float64)
+
+        for adm_level in adm_levels:
+            pcode_index = {pcode: i for i, pcode in enumerate(pcodes[adm_level])}
             for lead_time, pcode in itertools.product(
-                range(1, 8), list(country_gdf[f"adm{adm_level}_pcode"].unique())
+                range(1, 8),
+                list(country_gdfs[adm_level][f"adm{adm_level}_pcode"].unique()),
             ):
-                key = f"{pcode}_{lead_time}"
                 self.data.discharge_admin.upsert_data_unit(
                     DischargeDataUnit(
                         adm_level=adm_level,
                         pcode=pcode,
                         lead_time=lead_time,
-                        discharge_ensemble=discharges[key],
+                        discharge_ensemble=discharges[adm_level][
+                            pcode_index[pcode], lead_time - 1
+                        ].tolist(),
+                        discharge_mean=float(
+                            discharges_mean[adm_level][
+                                pcode_index[pcode], lead_time - 1
+                            ]
+                        ),
                     )
                 )
 
-        logging.info("Extract station-level river discharge from GloFAS data")
-
-        discharges_stations = {}
-        for ensemble in range(0, no_ens):
-            filename = os.path.join(
-                self.inputPathGrid,
-                f"GloFAS_{date}_{country}_{ensemble}.nc",
-            )
-            if not os.path.exists(filename):
-                logging.warning(
-                    f"Country-specific NetCDF file of ensemble {ensemble} not found, skipping"
-                )
-                continue
-            with rasterio.open(filename) as src:
-                for station_code in self.data.threshold_station.get_station_codes():
-                    station = self.data.threshold_station.get_data_unit(
-                        station_code=station_code
-                    )  # get station information from preloaded thresholds
-                    coords = [(float(station.lon), float(station.lat))]
-                    for lead_time in range(1, 8):
-                        # Extract data for stations
-                        discharge = float(
-                            [x[0] for x in src.sample(coords, indexes=lead_time)][0]
-                        )
-                        key = f"{station.station_code}_{lead_time}"
-                        if key not in discharges_stations.keys():
-                            discharges_stations[key] = []
-                        discharges_stations[key].append(
-                            discharge if not pd.isna(discharge) else 0.0
-                        )
-
-        for station_code in self.data.threshold_station.get_station_codes():
-            station = self.data.threshold_station.get_data_unit(
-                station_code=station_code
-            )
+        for i, station in enumerate(stations):
             for lead_time in range(1, 8):
-                key = f"{station_code}_{lead_time}"
                 self.data.discharge_station.upsert_data_unit(
                     DischargeStationDataUnit(
-                        station_code=station_code,
+                        station_code=station.station_code,
                         station_name=station.station_name,
                         lat=station.lat,
                         lon=station.lon,
                         pcodes=station.pcodes,
                         lead_time=lead_time,
-                        discharge_ensemble=discharges_stations[key],
+                        discharge_ensemble=discharges_stations[
+                            i, lead_time - 1
+                        ].tolist(),
+                        discharge_mean=float(
+                            discharges_stations_mean[i, lead_time - 1]
+                        ),
                     )
                 )
 
-    def prepare_glofas_data(self, country: str = None, debug: bool = False):
+    def prepare_glofas_data(
+        self, country: str = None, debug: bool = False, cache: bool = False
+    ):
         """
-        For each ensemble member, download the global NetCDF file and slice it to the extent of the country
+        For each ensemble member, download the global NetCDF file and slice it to the extent of the country;
+        sliced data is kept in memory for extraction and only written to disk if cache is True
         """
         if country is None:
             country = self.country
@@ -254,51 +383,115 @@ class Extract:
             no_ens = 1
             date = (datetime.today() - timedelta(days=1)).strftime("%Y%m%d")
 
-        for ensemble in range(0, no_ens):
-            # Download netcdf file
-            logging.info(f"downloading GloFAS data for ensemble {ensemble}")
-            filename_local = os.path.join(self.inputPathGrid, f"GloFAS_{ensemble}.nc")
-            try:
-                self.load.get_from_blob(
-                    filename_local,
-                    f"{self.settings.get_setting('blob_storage_path')}"
-                    f"/glofas-data/{date}/dis_{'{:02d}'.format(ensemble)}_{date}00.nc",
-                )
-            except FileNotFoundError:
-                logging.warning(
-                    f"NetCDF file of ensemble {ensemble} not found, skipping"
+        # Download and slice ensemble members in parallel
+        country_bounds = country_gdf.total_bounds
+        with ThreadPoolExecutor(
+            max_workers=self.settings.get_setting("no_download_workers", default=8)
+        ) as pool:
+            futures = [
+                pool.submit(
+                    self.__prepare_glofas_ensemble,
+                    country,
+                    date,
+                    ensemble,
+                    country_bounds,
+                    cache,
                 )
-                continue
+                for ensemble in range(0, no_ens)
+            ]
+            for future in as_completed(futures):
+                future.result()
+        logging.info("finished preparing GloFAS data")
+
+    def __prepare_glofas_ensemble(
+        self,
+        country: str,
+        date: str,
+        ensemble: int,
+        country_bounds: list,
+        cache: bool = False,
+    ):
+        """Download the global NetCDF file of one ensemble member and slice it"""
+        filename_local_sliced = self.__get_sliced_filename(country, date, ensemble)
+        if os.path.exists(filename_local_sliced):
+            logging.info(
+                f"GloFAS data for ensemble {ensemble} already sliced, skipping"
+            )
+            return
 
-            logging.info(f"slicing GloFAS data for ensemble {ensemble}")
+        try:
             try:
-                nc_file = xr.open_dataset(filename_local)
-            except ValueError:
+                filename_local = self.__download_glofas_data(date, ensemble)
+            except ConnectionError:
                 logging.warning(
-                    f"Something is wrong with this file, trying to download again"
+                    f"Incomplete download of ensemble {ensemble}, trying to download again"
                 )
-                self.load.get_from_blob(
-                    filename_local,
-                    f"{self.settings.get_setting('blob_storage_path')}"
-                    f"/glofas-data/{date}/dis_{'{:02d}'.format(ensemble)}_{date}00.nc",
-                )
-                try:
-                    nc_file = xr.open_dataset(filename_local)
-                except ValueError:
-                    logging.warning(
-                        f"Something is definitely wrong with this file, skipping"
-                    )
-                    continue
-
-            # Slice netcdf file to country boundaries
-            country_bounds = country_gdf.total_bounds
-            nc_file_sliced = slice_netcdf_file(nc_file, country_bounds)
-            filename_local_sliced = os.path.join(
-                self.inputPathGrid,
-                f"GloFAS_{date}_{country}_{ensemble}.nc",
-            )
-            nc_file_sliced.to_netcdf(filename_local_sliced)
+                filename_local = self.__download_glofas_data(date, ensemble)
+        except FileNotFoundError:
+            logging.warning(f"NetCDF file of ensemble {ensemble} not found, skipping")
+            return
+        except ConnectionError:
+            logging.warning(f"NetCDF file of ensemble {ensemble} incomplete, skipping")
+            filename_local = self.__get_download_filename(ensemble)
+            if os.path.exists(filename_local):
+                os.remove(filename_local)
+            return
 
-            nc_file.close()
+        logging.info(f"slicing GloFAS data for ensemble {ensemble}")
+        try:
+            with netcdf_lock:
+                nc_file = netCDF4.Dataset(filename_local)
+        except OSError:
+            logging.warning(
+                f"NetCDF file of ensemble {ensemble} cannot be opened, skipping"
+            )
             os.remove(filename_local)
-        logging.info("finished preparing GloFAS data")
+            return
+
+        # Slice netcdf file to country boundaries, reading only the country subset
+        # and, unless all time steps are cached, only the 7 lead times extracted
+        with netcdf_lock, nc_file:
+            var_data, lon, lat = slice_netcdf_file(
+                nc_file, country_bounds, None if cache else 7
+            )
+            transform = get_netcdf_transform(nc_file, lon, lat)
+            if cache:
+                write_netcdf_file(filename_local_sliced, nc_file, var_data, lon, lat)
+                var_data = var_data[:7].copy()
+        os.remove(filename_local)
+
+        self.glofas_data[(country, date, ensemble)] = (var_data, transform)
+
+    def __get_glofas_data(self, country: str, date: str, ensemble: int):
+        """
+        Get the sliced GloFAS data of one ensemble member (lead times, lat, lon) and its transform,
+        from memory if prepared in this run, otherwise from the cached NetCDF file
+        """
+        if (country, date, ensemble) in self.glofas_data:
+            return self.glofas_data[(country, date, ensemble)]
+        filename = self.__get_sliced_filename(country, date, ensemble)
+        if not os.path.exists(filename):
+            return None
+        with rasterio.open(filename) as src:
+            return src.read(list(range(1, 8)), out_dtype="float32"), src.transform
+
+    def __get_sliced_filename(self, country: str, date: str, ensemble: int) -> str:
+        """Get the path of the cached NetCDF file of one ensemble member, sliced to the country"""
+        return os.path.join(
+            self.inputPathGrid, f"GloFAS_{date}_{country}_{ensemble}.nc"
+        )
+
+    def __get_download_filename(self, ensemble: int) -> str:
+        """Get the path of the downloaded global NetCDF file of one ensemble member"""
+        return os.path.join(self.inputPathGrid, f"GloFAS_{ensemble}.nc")
+
+    def __download_glofas_data(self, date: str, ensemble: int) -> str:
+        """Download the global NetCDF file of one ensemble member, return its path"""
+        logging.info(f"downloading GloFAS data for ensemble {ensemble}")
+        filename_local = self.__get_download_filename(ensemble)
+        self.load.get_from_blob(
+            filename_local,
+            f"{self.settings.get_setting('blob_storage_path')}"
+            f"/glofas-data/{date}/dis_{'{:02d}'.format(ensemble)}_{date}00.nc",
+        )
+        return filename_local
@@ -7,36 +7,104 @@ from floodpipeline.data import (
     ForecastStationDataUnit,
 )
 from floodpipeline.load import Load
+from floodpipeline.raster import (
+    get_raster_window,
+    get_zone_pixels,
+    zonal_sum,
+    get_grid_indices,
+)
 from datetime import datetime
 from typing import List
 from shapely import Polygon
-from shapely.geometry import shape
-import pandas as pd
-from rasterstats import zonal_stats
 import os
 import numpy as np
 import rasterio
-from rasterio.merge import merge
+from rasterio.transform import Affine
+from rasterio.windows import Window, from_bounds
 from rasterio.mask import mask
-from rasterio.features import shapes
+from rasterio.features import rasterize
 import shutil
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+# decompress raster blocks with multiple threads, larger block cache (MB)
+GDAL_READ_OPTIONS = {"GDAL_NUM_THREADS": "ALL_CPUS", "GDAL_CACHEMAX": 512}
+# value of population pixels never affected by floods (see compute_pop_per_zone)
+AFFECTED_NEVER = 255
 
-def merge_rasters(raster_filepaths: list) -> tuple:
-    """Merge rasters into a single one, return the merged raster and its metadata"""
-    if len(raster_filepaths) > 0:
-        with rasterio.open(raster_filepaths[0]) as src:
-            out_meta = src.meta.copy()
-    mosaic, out_trans = merge(raster_filepaths)
-    out_meta.update(
-        {
-            "driver": "GTiff",
-            "height": mosaic.shape[1],
-            "width": mosaic.shape[2],
-            "transform": out_trans,
-        }
-    )
-    return mosaic, out_meta
+
+def merge_rasters_to(
+    raster_filepaths: list, out_filepath: str, nan_to_num: bool = False, **meta
+):
+    """
+    Merge single-band rasters on the same grid into a single one and save it one
+    block at a time, the first raster wins where they overlap (as with rasterio.merge);
+    optionally replace NaN with 0, update the output metadata with meta
+    """
+    with ExitStack() as stack:
+        sources = [
+            stack.enter_context(rasterio.open(raster_filepath))
+            for raster_filepath in raster_filepaths
+        ]
+        res_x, res_y = sources[0].res
+        left = min(src.bounds.left for src in sources)
+        bottom = min(src.bounds.bottom for src in sources)
+        right = max(src.bounds.right for src in sources)
+        top = max(src.bounds.top for src in sources)
+        out_meta = sources[0].meta.copy()
+        out_meta.update(
+            {
+                "driver": "GTiff",
+                "count": 1,
+                "height": int(round((top - bottom) / res_y)),
+                "width": int(round((right - left) / res_x)),
+                "transform": Affine.translation(left, top)
+                * Affine.scale(res_x, -res_y),
+                "tiled": True,
+                "blockxsize": 512,
+                "blockysize": 512,
+                "BIGTIFF": "IF_SAFER",
+                "NUM_THREADS": "ALL_CPUS",
+            }
+        )
+        out_meta.update(meta)
+        fill_value = out_meta["nodata"] if out_meta["nodata"] is not None else 0
+
+        dest = stack.enter_context(rasterio.open(out_filepath, "w", **out_meta))
+        for _, window in dest.block_windows(1):
+            block = np.full((window.height, window.width), fill_value, dtype="float64")
+            filled = np.zeros(block.shape, dtype=bool)
+            for src in sources:
+                # part of the block covered by the source raster
+                src_window = from_bounds(
+                    *dest.window_bounds(window), transform=src.transform
+                )
+                row_off, col_off = round(src_window.row_off), round(src_window.col_off)
+                row_start, row_stop = max(row_off, 0), min(
+                    row_off + window.height, src.height
+                )
+                col_start, col_stop = max(col_off, 0), min(
+                    col_off + window.width, src.width
+                )
+                if row_start >= row_stop or col_start >= col_stop:
+                    continue
+                data = src.read(
+                    1,
+                    window=Window(
+                        col_start, row_start, col_stop - col_start, row_stop - row_start
+                    ),
+                    masked=True,
+                )
+                block_slices = (
+                    slice(row_start - row_off, row_stop - row_off),
+                    slice(col_start - col_off, col_stop - col_off),
+                )
+                valid = ~np.ma.getmaskarray(data) & ~filled[block_slices]
+                block[block_slices][valid] = data.data[valid]
+                filled[block_slices] |= valid
+            if nan_to_num:
+                block = np.nan_to_num(block)
+            dest.write(block.astype(out_meta["dtype"]), 1, window=window)
 
 
 def clip_raster(
@@ -54,11 +122,170 @@ def clip_raster(
             "width": outImage.shape[2],
             "transform": out_transform,
             "compress": "lzw",
+            "tiled": True,
+            "blockxsize": 256,
+            "blockysize": 256,
+            "BIGTIFF": "IF_SAFER",
+            "NUM_THREADS": "ALL_CPUS",
         }
     )
     return outImage, outMeta
 
 
+def compute_likelihoods(discharge_ensemble: list, thresholds: list) -> np.ndarray:
+    """
+    Compute the likelihood of exceeding each threshold, i.e. the fraction of
+    ensemble members with discharge above the threshold value
+    """
+    ensemble = np.asarray(discharge_ensemble, dtype=np.float64)
+    threshold_values = np.asarray(
+        [threshold["threshold_value"] for threshold in thresholds], dtype=np.float64
+    )
+    return (ensemble[None, :] > threshold_values[:, None]).mean(axis=1)
+
+
+def compute_likelihoods_batch(discharge_ensembles: list, thresholds: list) -> list:
+    """
+    Compute the likelihoods of exceeding the thresholds for many data units at once,
+    one array per data unit; data units are processed one by one if their ensembles
+    or thresholds do not all have the same size
+    """
+    if len(discharge_ensembles) == 0:
+        return []
+    if (
+        len(set(map(len, discharge_ensembles))) > 1
+        or len(set(map(len, thresholds))) > 1
+    ):
+        return [
+            compute_likelihoods(discharge_ensemble, thresholds_)
+            for discharge_ensemble, thresholds_ in zip(discharge_ensembles, thresholds)
+        ]
+    ensembles = np.asarray(discharge_ensembles, dtype=np.float64)
+    threshold_values = np.asarray(
+        [[threshold["threshold_value"] for threshold in t] for t in thresholds],
+        dtype=np.float64,
+    ).reshape(len(thresholds), -1)
+    return list((ensembles[:, None, :] > threshold_values[:, :, None]).mean(axis=2))
+
+
+def write_flood_extent(
+    raster_filepath: str, zones_rp: list, rp_raster_filepaths: list, meta: dict
+):
+    """
+    Write a flood extent raster given a list of (geometry, index of the return period
+    raster, starting at 1); the first geometry wins where they overlap.
+    The raster is written one block at a time, reading only the matching window of
+    the return period rasters used in each block
+    """
+    zones = rasterize(
+        reversed(zones_rp),
+        out_shape=(meta["height"], meta["width"]),
+        transform=meta["transform"],
+        fill=0,
+        dtype=np.uint8,
+    )
+    with ExitStack() as stack:
+        # rasterio.Env is thread-local, set the read options in the writing thread
+        stack.enter_context(rasterio.Env(**GDAL_READ_OPTIONS))
+        # open each return period raster once (per thread, datasets are not thread-safe)
+        rp_rasters = {
+            zone: stack.enter_context(rasterio.open(rp_raster_filepaths[zone - 1]))
+            for zone in np.unique(zones[zones > 0])
+        }
+        dest = stack.enter_context(rasterio.open(raster_filepath, "w", **meta))
+        for _, window in dest.block_windows(1):
+            zones_block = zones[window.toslices()]
+            flood_raster_data = np.zeros(zones_block.shape, dtype=meta["dtype"])
+            for zone in np.unique(zones_block[zones_block > 0]):
+                src = rp_rasters[zone]
+                rp_data = src.read(1, window=window)
+                in_zone = zones_block == zone
+                if src.nodata is not None:
+                    in_zone &= ~(
+                        np.isnan(rp_data)
+                        if np.isnan(src.nodata)
+                        else rp_data == src.nodata
+                    )
+                flood_raster_data[in_zone] = rp_data[in_zone]
+            dest.write(flood_raster_data, 1, window=window)
+
+
+def compute_pop_per_zone(
+    geometries: list,
+    pop_raster: str,
+    affected_since: np.ndarray = None,
+    affected_offset: tuple = (0, 0),
+    lead_times: list = None,
+) -> tuple:
+    """
+    Sum the population and the affected population per geometry (all touched pixels).
+    affected_since holds, for a crop of the population raster starting at
+    affected_offset (row, col), the index in lead_times from which each pixel is
+    affected (AFFECTED_NEVER if not affected).
+    Return the population array and a dict of affected population arrays per lead time
+    (only for lead times with affected pixels)
+    """
+    # read only the part of the population raster covering the geometries
+    geometries_bounds = np.array([geometry.bounds for geometry in geometries])
+    bounds = [
+        *geometries_bounds[:, :2].min(axis=0),
+        *geometries_bounds[:, 2:].max(axis=0),
+    ]
+    with rasterio.open(pop_raster) as src:
+        window = get_raster_window(src.transform, src.shape, bounds)
+        pop_array = src.read(1, window=window, out_dtype=np.float32)
+        np.maximum(pop_array, 0.0, out=pop_array)
+        pop_transform = src.window_transform(window)
+    zones = get_zone_pixels(geometries, pop_array.shape, pop_transform)
+    pop = zonal_sum(pop_array, zones)
+
+    aff_pop = {}
+    if affected_since is None:
+        return pop, aff_pop
+    # population within the affected crop, whose origin is (row_off, col_off) pixels
+    # after the one of the population window
+    row_off = affected_offset[0] - window.row_off
+    col_off = affected_offset[1] - window.col_off
+    row_start, row_stop = max(row_off, 0), min(
+        row_off + affected_since.shape[0], pop_array.shape[0]
+    )
+    col_start, col_stop = max(col_off, 0), min(
+        col_off + affected_since.shape[1], pop_array.shape[1]
+    )
+    pop_affected_area = np.zeros(affected_since.shape, dtype=np.float32)
+    if row_start < row_stop and col_start < col_stop:
+        pop_affected_area[
+            row_start - row_off : row_stop - row_off,
+            col_start - col_off : col_stop - col_off,
+        ] = pop_array[row_start:row_stop, col_start:col_stop]
+    del pop_array
+    for index, lead_time in enumerate(lead_times):
+        affected = affected_since <= index
+        if affected.any():
+            aff_pop[lead_time] = zonal_sum(
+                np.where(affected, pop_affected_area, 0.0), zones, row_off, col_off
+            )
+    return pop, aff_pop
+
+
+def get_return_period_indices(
+    likelihoods: list, minimum_probability: float
+) -> np.ndarray:
+    """
+    For each data unit, get the index of the last threshold (in threshold order) whose
+    likelihood is at least minimum_probability, -1 if there is none
+    """
+    if len(likelihoods) == 0 or len(set(map(len, likelihoods))) > 1:
+        indices = []
+        for likelihoods_unit in likelihoods:
+            hit = np.flatnonzero(likelihoods_unit >= minimum_probability)
+            indices.append(hit[-1] if hit.size > 0 else -1)
+        return np.asarray(indices, dtype=int)
+    hits = np.asarray(likelihoods) >= minimum_probability
+    last_hit = hits.shape[1] - 1 - np.argmax(hits[:, ::-1], axis=1)
+    return np.where(hits.any(axis=1), last_hit, -1)
+
+
 def classify_alert(
     triggered: str,
     likelihood_per_return_period: dict,
@@ -79,16 +306,16 @@ def classify_alert(
                 "to classify alerts on return period, alert-on-return-period should be a dictionary "
                 "and alert-on-minimum-probability should be a float"
             )
-        alert_on_return_period = {
-            k: v
-            for k, v in sorted(alert_on_return_period.items(), key=lambda item: item[1])
-        }  # order by return period, from smallest to largest
-        for class_, return_period in alert_on_return_period.items():
+        # the highest return period whose likelihood is above the minimum wins
+        for class_, return_period in reversed(
+            sorted(alert_on_return_period.items(), key=lambda item: item[1])
+        ):
             if (
                 likelihood_per_return_period[return_period]
                 >= alert_on_minimum_probability
             ):
                 alert_class = class_
+                break
     elif classify_alert_on == "probability":
         if (
             type(alert_on_minimum_probability) != dict
@@ -98,18 +325,14 @@ def classify_alert(
                 "to classify alerts on minimum probability, alert-on-minimum-probability should be a dictionary "
                 "and alert-on-return-period should be a float"
             )
-        alert_on_minimum_probability = {
-            k: v
-            for k, v in sorted(
-                alert_on_minimum_probability.items(), key=lambda item: item[1]
-            )
-        }  # order by probability, from smallest to largest
-        for class_, minimum_probability in alert_on_minimum_probability.items():
-            if (
-                likelihood_per_return_period[alert_on_return_period]
-                >= minimum_probability
-            ):
+        # the highest minimum probability below the likelihood wins
+        likelihood = likelihood_per_return_period[alert_on_return_period]
+        for class_, minimum_probability in reversed(
+            sorted(alert_on_minimum_probability.items(), key=lambda item: item[1])
+        ):
+            if likelihood >= minimum_probability:
                 alert_class = class_
+                break
     elif classify_alert_on == "disable":
         if triggered and type(alert_on_return_period) == dict:
             alert_class = max(alert_on_return_period, key=alert_on_return_period.get)
@@ -143,10 +366,16 @@ class Forecast:
         self.input_data_path: str = "data/input"
         self.output_data_path: str = "data/output"
         self.flood_extent_raster: str = self.output_data_path + "/flood_extent.tif"
-        self.pop_raster: str = self.input_data_path + "/population_density.tif"
-        self.aff_pop_raster: str = self.output_data_path + "/affected_population.tif"
         self.data = data
 
+    @property
+    def pop_raster(self) -> str:
+        """Population density raster of the country, kept across runs"""
+        return (
+            self.input_data_path
+            + f"/population_density_{self.data.forecast_admin.country.upper()}.tif"
+        )
+
     def set_settings(self, settings):
         """Set settings"""
         if not isinstance(settings, Settings):
@@ -167,8 +396,9 @@ class Forecast:
         """
         os.makedirs(self.input_data_path, exist_ok=True)
         os.makedirs(self.output_data_path, exist_ok=True)
-        self.compute_forecast_admin()
-        self.compute_forecast_station()
+        with rasterio.Env(**GDAL_READ_OPTIONS):
+            self.compute_forecast_admin()
+            self.compute_forecast_station()
 
     def compute_forecast_admin(self):
         """
@@ -205,68 +435,86 @@ class Forecast:
             country, "alert-on-minimum-probability"
         )
 
+        lead_times = self.data.discharge_admin.get_lead_times()
+        units = []
         for pcode in self.data.discharge_admin.get_pcodes():
             threshold_data_unit = self.data.threshold_admin.get_data_unit(pcode)
-            for lead_time in self.data.discharge_admin.get_lead_times():
+            return_periods = [
+                t["return_period"] for t in threshold_data_unit.thresholds
+            ]
+            if trigger_on_return_period not in return_periods:
+                raise ValueError(
+                    f"No threshold found for return period {trigger_on_return_period} "
+                    f"in admin division {pcode}, which defines trigger in config file "
+                    f"(trigger-on-return-period). Thresholds found: {return_periods}"
+                )
+            for lead_time in lead_times:
                 discharge_data_unit = self.data.discharge_admin.get_data_unit(
                     pcode, lead_time
                 )
-                adm_level = discharge_data_unit.adm_level
-
-                # calculate likelihood per return period
-                likelihood_per_return_period, forecasts = {}, []
-                for threshold in threshold_data_unit.thresholds:
-                    threshold_checks = map(
-                        lambda x: 1 if x > threshold["threshold_value"] else 0,
-                        discharge_data_unit.discharge_ensemble,
-                    )
-                    likelihood = sum(threshold_checks) / len(
-                        discharge_data_unit.discharge_ensemble
-                    )
-                    return_period = threshold["return_period"]
-                    likelihood_per_return_period[return_period] = likelihood
-                    forecasts.append(
-                        FloodForecast(
-                            return_period=return_period, likelihood=likelihood
-                        )
-                    )
-
-                # determine if triggered and the corresponding return period
-                triggered = (
-                    True
-                    if likelihood_per_return_period[trigger_on_return_period]
-                    >= trigger_on_minimum_probability
-                    and lead_time <= trigger_on_lead_time
-                    else False
-                )
-                return_period = next(
-                    (
-                        key
-                        for key, value in reversed(likelihood_per_return_period.items())
-                        if value >= trigger_on_minimum_probability
-                    ),
-                    0.0,
+                units.append(
+                    (pcode, lead_time, discharge_data_unit, threshold_data_unit)
                 )
 
-                # determine the alert class
-                alert_class = classify_alert(
-                    triggered,
-                    likelihood_per_return_period,
-                    classify_alert_on,
-                    alert_on_return_period,
-                    alert_on_minimum_probability,
-                )
+        # calculate likelihood per return period for all admin divisions at once
+        likelihoods_units = compute_likelihoods_batch(
+            [unit[2].discharge_ensemble for unit in units],
+            [unit[3].thresholds for unit in units],
+        )
 
-                forecast_data_unit = ForecastDataUnit(
-                    adm_level=adm_level,
-                    pcode=pcode,
-                    lead_time=lead_time,
-                    forecasts=forecasts,
-                    triggered=triggered,
-                    return_period=return_period,
-                    alert_class=alert_class,
+        return_period_indices = get_return_period_indices(
+            likelihoods_units, trigger_on_minimum_probability
+        )
+
+        for unit, likelihoods, return_period_index in zip(
+            units, likelihoods_units, return_period_indices
+        ):
+            pcode, lead_time, discharge_data_unit, threshold_data_unit = unit
+            adm_level = discharge_data_unit.adm_level
+
+            likelihood_per_return_period, forecasts = {}, []
+            for threshold, likelihood in zip(
+                threshold_data_unit.thresholds, likelihoods.tolist()
+            ):
+                return_period = threshold["return_period"]
+                likelihood_per_return_period[return_period] = likelihood
+                forecasts.append(
+                    FloodForecast(return_period=return_period, likelihood=likelihood)
                 )
-                self.data.forecast_admin.upsert_data_unit(forecast_data_unit)
+
+            # determine if triggered and the corresponding return period
+            triggered = (
+                True
+                if likelihood_per_return_period[trigger_on_return_period]
+                >= trigger_on_minimum_probability
+                and lead_time <= trigger_on_lead_time
+                else False
+            )
+            return_period = (
+                threshold_data_unit.thresholds[return_period_index]["return_period"]
+                if return_period_index >= 0
+                else 0.0
+            )
+
+            # determine the alert class
+            alert_class = classify_alert(
+                triggered,
+                likelihood_per_return_period,
+                classify_alert_on,
+                alert_on_return_period,
+                alert_on_minimum_probability,
+            )
+
+            forecast_data_unit = ForecastDataUnit(
+                adm_level=adm_level,
+                pcode=pcode,
+                lead_time=lead_time,
+                forecasts=forecasts,
+                triggered=triggered,
+                return_period=return_period,
+                alert_class=alert_class,
+            )
+            self.data.forecast_admin.upsert_data_unit(forecast_data_unit)
 
     def __compute_flood_extent(self):
         """Compute flood extent raster"""
@@ -276,196 +524,222 @@ class Forecast:
             os.remove(self.flood_extent_raster)
         flood_rasters = {}
         for rp in [10, 20, 50, 75, 100, 200, 500]:
-            flood_raster_filepath = (
+            flood_rasters[rp] = (
                 self.input_data_path + f"/flood_map_{country.upper()}_RP{rp}.tif"
             )
-            if not os.path.exists(flood_raster_filepath):
-                self.load.get_from_blob(
+
+        # flood extent rasters needed by triggered admin divisions, if the return
+        # period is not available use the smallest available; at least one is needed
+        # as template of the empty raster
+        adm_lvl = self.data.forecast_admin.adm_levels[-1]
+        rps_needed = {
+            (
+                forecast_data_unit.return_period
+                if forecast_data_unit.return_period in flood_rasters.keys()
+                else min(flood_rasters.keys())
+            )
+            for forecast_data_unit in self.data.forecast_admin.get_data_units(
+                adm_level=adm_lvl
+            )
+            if forecast_data_unit.triggered
+        } or {min(flood_rasters.keys())}
+
+        # download missing flood extent rasters in parallel
+        with ThreadPoolExecutor(
+            max_workers=self.settings.get_setting("no_download_workers", default=8)
+        ) as pool:
+            futures = [
+                pool.submit(
+                    self.load.get_from_blob,
                     flood_raster_filepath,
                     f"{self.settings.get_setting('blob_storage_path')}"
                     f"/flood-maps/{country.upper()}/flood_map_{country.upper()}_RP{rp}.tif",
                 )
-            flood_rasters[rp] = flood_raster_filepath
+                for rp, flood_raster_filepath in flood_rasters.items()
+                if rp in rps_needed and not os.path.exists(flood_raster_filepath)
+            ]
+            for future in as_completed(futures):
+                future.result()
 
         # create empty raster
         empty_raster = self.flood_extent_raster.replace(".tif", "_empty.tif")
-        with rasterio.open(list(flood_rasters.values())[0]) as src:
-            flood_raster_data = src.read()
-            flood_raster_data = np.empty(flood_raster_data.shape)
+        with rasterio.open(flood_rasters[min(rps_needed)]) as src:
             flood_raster_meta = src.meta.copy()
-            flood_raster_meta["compress"] = "lzw"
-            with rasterio.open(empty_raster, "w", **flood_raster_meta) as dest:
-                dest.write(flood_raster_data)
+            flood_raster_bounds = src.bounds
+        flood_raster_meta.update(
+            {
+                "compress": "lzw",
+                "tiled": True,
+                "blockxsize": 512,
+                "blockysize": 512,
+                "BIGTIFF": "IF_SAFER",
+                "NUM_THREADS": "ALL_CPUS",
+            }
+        )
+        with rasterio.open(empty_raster, "w", **flood_raster_meta) as dest:
+            for _, window in dest.block_windows(1):
+                dest.write(
+                    np.zeros(
+                        (window.height, window.width), dtype=flood_raster_meta["dtype"]
+                    ),
+                    1,
+                    window=window,
+                )
 
-        adm_lvl = self.data.forecast_admin.adm_levels[-1]
         # get adm boundaries
         gdf_adm = self.load.get_adm_boundaries(
             self.data.forecast_admin.country, adm_lvl
         )
-        gdf_adm.index = gdf_adm[f"adm{adm_lvl}_pcode"]
+        geom_by_pcode = dict(zip(gdf_adm[f"adm{adm_lvl}_pcode"], gdf_adm.geometry))
+        # admin divisions outside the flood maps, whose flood extent is always empty
+        adm_bounds = gdf_adm.bounds
+        pcodes_off_map = set(
+            gdf_adm.loc[
+                (adm_bounds["minx"] >= flood_raster_bounds.right)
+                | (adm_bounds["maxx"] <= flood_raster_bounds.left)
+                | (adm_bounds["miny"] >= flood_raster_bounds.top)
+                | (adm_bounds["maxy"] <= flood_raster_bounds.bottom),
+                f"adm{adm_lvl}_pcode",
+            ]
+        )
 
+        return_periods = list(flood_rasters.keys())
+        zones_rp_lead_time = {}
         for lead_time in self.data.forecast_admin.get_lead_times():
 
             raster_lead_time = self.flood_extent_raster.replace(
                 ".tif", f"_{lead_time}.tif"
             )
 
-            # calculate flood extent for each triggered admin division
-            flood_rasters_admin_div = []
+            # assign each triggered admin division to the return period to use
+            zones_rp = []
             for forecast_data_unit in self.data.forecast_admin.get_data_units(
                 lead_time=lead_time, adm_level=adm_lvl
             ):
-                if forecast_data_unit.triggered:
-                    adm_bounds = gdf_adm.loc[forecast_data_unit.pcode, "geometry"]
+                if (
+                    forecast_data_unit.triggered
+                    and forecast_data_unit.pcode not in pcodes_off_map
+                ):
+                    adm_bounds = geom_by_pcode[forecast_data_unit.pcode]
                     rp = forecast_data_unit.return_period
 
                     # if return period is not available, use the smallest available
                     if rp not in flood_rasters.keys():
                         rp = min(flood_rasters.keys())
+                    zones_rp.append((adm_bounds, return_periods.index(rp) + 1))
 
-                    # clip flood extent raster with admin division boundaries
-                    flood_raster_data, flood_raster_meta = clip_raster(
-                        flood_rasters[rp], [adm_bounds]
-                    )
-                    # save the clipped raster
-                    flood_raster_admin_div = (
-                        f"data/output/flood_extent_{forecast_data_unit.pcode}.tif"
-                    )
-                    with rasterio.open(
-                        flood_raster_admin_div, "w", **flood_raster_meta
-                    ) as dest:
-                        dest.write(flood_raster_data)
-                    flood_rasters_admin_div.append(flood_raster_admin_div)
-
-            # merge flood extents of each triggered admin division
-            if len(flood_rasters_admin_div) > 0:
-                flood_rasters_admin_div.append(empty_raster)
-                flood_raster_data, flood_raster_meta = merge_rasters(
-                    flood_rasters_admin_div
-                )
-                flood_raster_meta["compress"] = "lzw"
-                with rasterio.open(raster_lead_time, "w", **flood_raster_meta) as dest:
-                    dest.write(flood_raster_data)
-                for file in flood_rasters_admin_div:
-                    if file != empty_raster:
-                        try:
-                            os.remove(file)
-                        except FileNotFoundError:
-                            pass
-            else:
+            if len(zones_rp) == 0:
                 shutil.copy(empty_raster, raster_lead_time)
+            else:
+                zones_rp_lead_time[raster_lead_time] = zones_rp
+
+        # write flood extent rasters, one lead time per thread; each thread holds the
+        # zones of the whole flood map and GDAL compresses with all CPUs, so only a
+        # few lead times are written at once
+        with ThreadPoolExecutor(
+            max_workers=self.settings.get_setting("no_flood_extent_workers", default=2)
+        ) as pool:
+            futures = [
+                pool.submit(
+                    write_flood_extent,
+                    raster_lead_time,
+                    zones_rp,
+                    list(flood_rasters.values()),
+                    flood_raster_meta,
+                )
+                for raster_lead_time, zones_rp in zones_rp_lead_time.items()
+            ]
+            for future in as_completed(futures):
+                future.result()
 
-    def __compute_affected_pop_raster(self):
-        """Compute affected population raster given a flood extent"""
+    def __compute_affected_area(self, lead_times: list) -> tuple:
+        """
+        Compute the area affected by floods on the population raster grid, return
+        for each pixel the index in lead_times from which it is affected
+        (AFFECTED_NEVER if not affected), cropped to the affected pixels, and the
+        (row, col) offset of the crop; (None, (0, 0)) if nothing is affected
+        """
         country = self.data.forecast_admin.country
-        # get population density raster
-        self.load.get_population_density(country, self.pop_raster)
-
-        flood_shapes = []
-        for lead_time in self.data.forecast_admin.get_lead_times():
+        # get population density raster, if not downloaded yet
+        if not os.path.exists(self.pop_raster):
+            self.load.get_population_density(country, self.pop_raster)
+
+        minimum_flood_depth = self.settings.get_setting("minimum_flood_depth")
+        with rasterio.open(self.pop_raster) as pop_src:
+            pop_transform, pop_shape = pop_src.transform, pop_src.shape
+        affected_since = np.full(pop_shape, AFFECTED_NEVER, dtype=np.uint8)
+        flood_rows, flood_cols = None, None
+        for index, lead_time in enumerate(lead_times):
             flood_raster_lead_time = self.flood_extent_raster.replace(
                 ".tif", f"_{lead_time}.tif"
             )
-            aff_pop_raster_lead_time = self.aff_pop_raster.replace(
-                ".tif", f"_{lead_time}.tif"
-            )
-            if os.path.exists(aff_pop_raster_lead_time):
-                os.remove(aff_pop_raster_lead_time)
             with rasterio.open(flood_raster_lead_time) as dataset:
-                # Read the dataset's valid data mask as a ndarray.
-                image = dataset.read(1).astype(np.float32)
-                image[image >= self.settings.get_setting("minimum_flood_depth")] = 1
-                rasterio_shapes = shapes(
-                    image, transform=dataset.transform
-                )  # convert flood extent raster to vector (list of shapes)
-                for geom, val in rasterio_shapes:
-                    if val >= self.settings.get_setting("minimum_flood_depth"):
-                        flood_shapes.append(shape(geom))
-            # clip population density raster with flood shapes and save the result
-            if len(flood_shapes) > 0:
-                affected_pop_raster, affected_pop_meta = clip_raster(
-                    self.pop_raster, flood_shapes
-                )
-                with rasterio.open(
-                    aff_pop_raster_lead_time, "w", **affected_pop_meta
-                ) as dest:
-                    dest.write(affected_pop_raster)
+                flooded = dataset.read(1) >= minimum_flood_depth
+                if flood_rows is None:
+                    flood_rows, flood_cols = get_grid_indices(
+                        pop_transform, pop_shape, dataset.transform
+                    )
+            # a population pixel is affected if its center is flooded
+            inside_rows = (flood_rows >= 0) & (flood_rows < flooded.shape[0])
+            inside_cols = (flood_cols >= 0) & (flood_cols < flooded.shape[1])
+            affected_since_inside = affected_since[np.ix_(inside_rows, inside_cols)]
+            affected_since_inside[
+                flooded[np.ix_(flood_rows[inside_rows], flood_cols[inside_cols])]
+                & (affected_since_inside == AFFECTED_NEVER)
+            ] = index
+            affected_since[np.ix_(inside_rows, inside_cols)] = affected_since_inside
+
+        affected = affected_since != AFFECTED_NEVER
+        if not affected.any():
+            return None, (0, 0)
+        rows = np.flatnonzero(affected.any(axis=1))
+        cols = np.flatnonzero(affected.any(axis=0))
+        return (
+            affected_since[rows[0] : rows[-1] + 1, cols[0] : cols[-1] + 1],
+            (int(rows[0]), int(cols[0])),
+        )
 
     def __compute_affected_pop(self):
         """Compute affected population given a flood extent"""
 
-        # calculate affected population raster
-        self.__compute_affected_pop_raster()
+        # calculate area affected from each lead time on
+        lead_times = self.data.forecast_admin.get_lead_times()
+        affected_since, affected_offset = self.__compute_affected_area(lead_times)
 
-        # calculate affected population per admin division
         for adm_lvl in self.data.forecast_admin.adm_levels:
-            # get adm boundaries
             gdf_adm = self.load.get_adm_boundaries(
                 self.data.forecast_admin.country, adm_lvl
             )
-            gdf_aff_pop, gdf_pop = pd.DataFrame(), pd.DataFrame()
+            pcodes = gdf_adm[f"adm{adm_lvl}_pcode"].tolist()
+
+            # calculate (affected) population per admin division
+            pop, aff_pop = compute_pop_per_zone(
+                list(gdf_adm.geometry),
+                self.pop_raster,
+                affected_since,
+                affected_offset,
+                lead_times,
+            )
+            pop_per_pcode = dict(zip(pcodes, pop))
+            aff_pop_per_pcode = {}
 
-            for lead_time in self.data.forecast_admin.get_lead_times():
-                aff_pop_raster_lead_time = self.aff_pop_raster.replace(
-                    ".tif", f"_{lead_time}.tif"
-                )
-                if os.path.exists(aff_pop_raster_lead_time):
-                    # perform zonal statistics on affected population raster
-                    with rasterio.open(aff_pop_raster_lead_time) as src:
-                        raster_array = src.read(1)
-                        raster_array[raster_array < 0.0] = 0.0
-                        transform = src.transform
-
-                    stats = zonal_stats(
-                        gdf_adm,
-                        raster_array,
-                        affine=transform,
-                        stats=["sum"],
-                        all_touched=True,
-                        nodata=0.0,
-                    )
-                    gdf_aff_pop = pd.concat([gdf_adm, pd.DataFrame(stats)], axis=1)
-                    gdf_aff_pop.index = gdf_aff_pop[f"adm{adm_lvl}_pcode"]
-
-                    # perform zonal statistics on population density raster (to compute % aff pop)
-                    with rasterio.open(self.pop_raster) as src:
-                        raster_array = src.read(1)
-                        raster_array[raster_array < 0.0] = 0.0
-                        transform = src.transform
-                    stats = zonal_stats(
-                        gdf_adm,
-                        raster_array,
-                        affine=transform,
-                        stats=["sum"],
-                        all_touched=True,
-                        nodata=0.0,
-                    )
-                    gdf_pop = pd.concat([gdf_adm, pd.DataFrame(stats)], axis=1)
-                    gdf_pop.index = gdf_pop[f"adm{adm_lvl}_pcode"]
+            for lead_time in lead_times:
+                if lead_time in aff_pop:
+                    aff_pop_per_pcode = dict(zip(pcodes, aff_pop[lead_time]))
 
                 # add affected population to forecast data units
                 for forecast_data_unit in self.data.forecast_admin.get_data_units(
                     adm_level=adm_lvl, lead_time=lead_time
                 ):
                     if forecast_data_unit.triggered:
-                        try:
-                            pop_affected = int(
-                                gdf_aff_pop.loc[forecast_data_unit.pcode, "sum"]
-                            )
-                        except (ValueError, TypeError, KeyError):
-                            pop_affected = 0
+                        pop_affected = int(
+                            aff_pop_per_pcode.get(forecast_data_unit.pcode, 0.0)
+                        )
+                        pop = pop_per_pcode.get(forecast_data_unit.pcode, 0.0)
                         forecast_data_unit.pop_affected = pop_affected
-                        try:
-                            forecast_data_unit.pop_affected_perc = (
-                                float(
-                                    pop_affected
-                                    / gdf_pop.loc[forecast_data_unit.pcode, "sum"]
-                                )
-                                * 100.0
-                            )
-
-                        except (ValueError, TypeError, KeyError):
-                            forecast_data_unit.pop_affected_perc = 0.0
+                        forecast_data_unit.pop_affected_perc = (
+                            float(pop_affected / pop) * 100.0 if pop > 0.0 else 0.0
+                        )
 
     def compute_forecast_station(self):
         """
@@ -484,41 +758,55 @@ class Forecast:
         trigger_on_lead_time = self.settings.get_country_setting(
             country, "trigger-on-lead-time"
         )
-        for discharge_station in self.data.discharge_station.data_units:
-            station_code = discharge_station.station_code
+        trigger_on_return_period = self.settings.get_country_setting(
+            country, "trigger-on-return-period"
+        )
+        trigger_on_minimum_probability = self.settings.get_country_setting(
+            country, "trigger-on-minimum-probability"
+        )
+        classify_alert_on = self.settings.get_country_setting(
+            country, "classify-alert-on"
+        )
+        alert_on_return_period = self.settings.get_country_setting(
+            country, "alert-on-return-period"
+        )
+        alert_on_minimum_probability = self.settings.get_country_setting(
+            country, "alert-on-minimum-probability"
+        )
+
+        # calculate likelihood per return period for all stations at once
+        discharge_stations = self.data.discharge_station.data_units
+        threshold_stations = [
+            self.data.threshold_station.get_data_unit(discharge_station.station_code)
+            for discharge_station in discharge_stations
+        ]
+        likelihoods_stations = compute_likelihoods_batch(
+            [ds.discharge_ensemble for ds in discharge_stations],
+            [ts.thresholds for ts in threshold_stations],
+        )
+
+        return_period_indices = get_return_period_indices(
+            likelihoods_stations, trigger_on_minimum_probability
+        )
+
+        for stations, likelihoods, return_period_index in zip(
+            zip(discharge_stations, threshold_stations),
+            likelihoods_stations,
+            return_period_indices,
+        ):
+            discharge_station, threshold_station = stations
             lead_time = discharge_station.lead_time
-            threshold_station = self.data.threshold_station.get_data_unit(station_code)
 
             likelihood_per_return_period, forecasts = {}, []
-            for threshold in threshold_station.thresholds:
-                threshold_checks = map(
-                    lambda x: 1 if x > threshold["threshold_value"] else 0,
-                    discharge_station.discharge_ensemble,
-                )
-                likelihood = sum(threshold_checks) / len(
-                    discharge_station.discharge_ensemble
-                )
+            for threshold, likelihood in zip(
+                threshold_station.thresholds, likelihoods.tolist()
+            ):
                 return_period = threshold["return_period"]
                 likelihood_per_return_period[return_period] = likelihood
                 forecasts.append(
                     FloodForecast(return_period=return_period, likelihood=likelihood)
                 )
 
-            trigger_on_return_period = self.settings.get_country_setting(
-                country, "trigger-on-return-period"
-            )
-            trigger_on_minimum_probability = self.settings.get_country_setting(
-                country, "trigger-on-minimum-probability"
-            )
-            classify_alert_on = self.settings.get_country_setting(
-                country, "classify-alert-on"
-            )
-            alert_on_return_period = self.settings.get_country_setting(
-                country, "alert-on-return-period"
-            )
-            alert_on_minimum_probability = self.settings.get_country_setting(
-                country, "alert-on-minimum-probability"
-            )
             if trigger_on_return_period not in likelihood_per_return_period.keys():
                 raise ValueError(
                     f"No threshold found for return period {trigger_on_return_period}, "
@@ -534,13 +822,10 @@ class Forecast:
                 and lead_time <= trigger_on_lead_time
                 else False
             )
-            return_period = next(
-                (
-                    key
-                    for key, value in reversed(likelihood_per_return_period.items())
-                    if value >= trigger_on_minimum_probability
-                ),
-                0.0,
+            return_period = (
+                threshold_station.thresholds[return_period_index]["return_period"]
+                if return_period_index >= 0
+                else 0.0
             )
 
             # determine the alert class
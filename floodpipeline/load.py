@@ -107,6 +107,9 @@ def alert_class_to_threshold(alert_class: str, triggered: bool) -> float:
 class Load:
     """Download/upload data from/to a data storage"""
 
+    # administrative boundaries per (country, admin level), shared by all instances
+    adm_boundaries = {}
+
     def __init__(self, settings: Settings = None, secrets: Secrets = None):
         self.secrets = None
         self.settings = None
@@ -147,15 +150,19 @@ class Load:
         r = requests.get(
             f"{self.settings.get_setting('worldpop_url')}/{country.upper()}/{country.lower()}_ppp_2022_1km_UNadj_constrained.tif"
         )
-        if "404 Not Found" in str(r.content):
+        if "404 Not Found" in str(r.content) or r.status_code == 404:
             raise FileNotFoundError(
                 f"Population density data not found for country {country}"
             )
+        # the file is kept across runs, do not save error pages
+        r.raise_for_status()
         with open(file_path, "wb") as file:
             file.write(r.content)
 
     def get_adm_boundaries(self, country: str, adm_level: int) -> gpd.GeoDataFrame:
-        """Get administrative boundaries from IBF API"""
+        """Get administrative boundaries from IBF API, download them once per country and admin level"""
+        if (country, adm_level) in Load.adm_boundaries:
+            return Load.adm_boundaries[(country, adm_level)].copy()
         try:
             with urllib.request.urlopen(
                 f"https://raw.githubusercontent.com/rodekruis/IBF-system/master/services/API-service/src/scripts/git-lfs/admin-boundaries/{country}_adm{adm_level}.json"
@@ -188,7 +195,8 @@ class Load:
         #         f"WARNING: no administrative boundaries found for country {country} "
         #         f"and adm_level {adm_level}"
         #     )
-        return gdf
+        Load.adm_boundaries[(country, adm_level)] = gdf
+        return gdf.copy()
 
     def __ibf_api_authenticate(self):
         no_attempts, attempt, login_response = 5, 0, None
@@ -287,15 +295,20 @@ class Load:
             },
         )
         gdf_stations = gpd.GeoDataFrame.from_features(stations["features"])
-        stations = []
-        for ix, row in gdf_stations.iterrows():
-            station = {
-                "stationCode": row["stationCode"],
-                "stationName": row["stationName"],
-                "lat": row["geometry"].y,
-                "lon": row["geometry"].x,
+        stations = [
+            {
+                "stationCode": station_code,
+                "stationName": station_name,
+                "lat": lat,
+                "lon": lon,
             }
-            stations.append(station)
+            for station_code, station_name, lat, lon in zip(
+                gdf_stations["stationCode"].to_numpy(),
+                gdf_stations["stationName"].to_numpy(),
+                gdf_stations.geometry.y.to_numpy(),
+                gdf_stations.geometry.x.to_numpy(),
+            )
+        ]
 
         return stations
 
@@ -831,10 +844,27 @@ class Load:
         """Get file from Azure Blob Storage"""
         blob_client = self.__get_blob_service_client(blob_path)
 
-        with open(local_path, "wb") as download_file:
-            try:
-                download_file.write(blob_client.download_blob().readall())
-            except ResourceNotFoundError:
-                raise FileNotFoundError(
-                    f"File {blob_path} not found in Azure Blob Storage"
+        try:
+            with open(local_path, "wb") as download_file:
+                # download byte ranges in parallel and stream them to file
+                downloader = blob_client.download_blob(
+                    max_concurrency=self.settings.get_setting(
+                        "no_blob_download_connections", default=4
+                    )
                 )
+                downloader.readinto(download_file)
+        except ResourceNotFoundError:
+            os.remove(local_path)
+            raise FileNotFoundError(f"File {blob_path} not found in Azure Blob Storage")
+        except Exception:
+            if os.path.exists(local_path):
+                os.remove(local_path)
+            raise
+        # do not leave a partial file, which would be reused as if complete
+        downloaded_size = os.path.getsize(local_path)
+        if downloaded_size != downloader.size:
+            os.remove(local_path)
+            raise ConnectionError(
+                f"Incomplete download of {blob_path} from Azure Blob Storage: "
+                f"{downloaded_size} of {downloader.size} bytes"
+            )
@@ -58,7 +58,9 @@ class Pipeline:
 
         if prepare:
             logging.info("prepare discharge data")
-            self.extract.prepare_glofas_data(country=self.country, debug=debug)
+            self.extract.prepare_glofas_data(
+                country=self.country, debug=debug, cache=not extract
+            )
 
         if extract:
             logging.info(f"extract discharge data")
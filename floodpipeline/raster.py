@@ -0,0 +1,120 @@
+import math
+from typing import List
+import numpy as np
+import rasterio
+from rasterio.features import geometry_mask
+from rasterio.transform import Affine
+from rasterio.windows import Window, from_bounds
+
+
+def get_raster_window(transform, shape: tuple, bounds: list) -> Window:
+    """Get the raster window covering the bounding box, padded by one pixel"""
+    window = from_bounds(*bounds, transform=transform)
+    col_off = math.floor(window.col_off) - 1
+    row_off = math.floor(window.row_off) - 1
+    width = math.ceil(window.col_off + window.width) + 1 - col_off
+    height = math.ceil(window.row_off + window.height) + 1 - row_off
+    return Window(col_off, row_off, width, height).intersection(
+        Window(0, 0, shape[1], shape[0])
+    )
+
+
+def zonal_max(raster: np.ndarray, zones: List[tuple]) -> np.ndarray:
+    """
+    Get the maximum value per zone of each band of a (bands, height, width) raster,
+    zones as given by get_zone_pixels; return an array of shape (zones, bands),
+    0.0 if a zone has no valid pixels
+    """
+    out = np.zeros((len(zones), raster.shape[0]), dtype=np.float32)
+    for i, (rows, cols) in enumerate(zones):
+        if rows.size > 0:
+            out[i] = np.nan_to_num(raster[:, rows, cols], nan=0.0).max(axis=1)
+    return out
+
+
+def sample_raster(raster: np.ndarray, transform, coords: list) -> np.ndarray:
+    """
+    Sample each band of a (bands, height, width) raster at a list of (x, y) coordinates,
+    return an array of shape (points, bands); 0.0 outside the raster or if no data
+    """
+    out = np.zeros((len(coords), raster.shape[0]), dtype=np.float32)
+    if not coords:
+        return out
+    xs, ys = zip(*coords)
+    rows, cols = rasterio.transform.rowcol(transform, xs, ys)
+    rows, cols = np.asarray(rows), np.asarray(cols)
+    inside = (
+        (rows >= 0) & (rows < raster.shape[1]) & (cols >= 0) & (cols < raster.shape[2])
+    )
+    out[inside] = raster[:, rows[inside], cols[inside]].T
+    return np.nan_to_num(out, nan=0.0)
+
+
+def get_zone_pixels(geometries, out_shape: tuple, transform) -> List[tuple]:
+    """
+    Get the (rows, cols) indices (int32) of the raster pixels touched by each geometry.
+    Each geometry is rasterized only within its bounding window, computed as
+    rasterstats does so that pixels touched exactly on their edges are the same
+    """
+    zones = []
+    for geometry in geometries:
+        minx, miny, maxx, maxy = geometry.bounds
+        row_start = math.floor((maxy - transform.f) / transform.e)
+        row_stop = math.ceil((miny - transform.f) / transform.e)
+        col_start = math.floor((minx - transform.c) / transform.a)
+        col_stop = math.ceil((maxx - transform.c) / transform.a)
+        if (
+            row_start >= min(row_stop, out_shape[0])
+            or col_start >= min(col_stop, out_shape[1])
+            or row_stop <= 0
+            or col_stop <= 0
+        ):
+            zones.append((np.array([], dtype=np.int32), np.array([], dtype=np.int32)))
+            continue
+        zone_mask = geometry_mask(
+            [geometry],
+            out_shape=(row_stop - row_start, col_stop - col_start),
+            transform=transform * Affine.translation(col_start, row_start),
+            all_touched=True,
+            invert=True,
+        )
+        rows, cols = np.nonzero(zone_mask)
+        rows, cols = rows + row_start, cols + col_start
+        # the window may extend beyond the raster
+        inside = (
+            (rows >= 0) & (rows < out_shape[0]) & (cols >= 0) & (cols < out_shape[1])
+        )
+        zones.append((rows[inside].astype(np.int32), cols[inside].astype(np.int32)))
+    return zones
+
+
+def zonal_sum(
+    raster: np.ndarray, zones: List[tuple], row_off: int = 0, col_off: int = 0
+) -> np.ndarray:
+    """
+    Sum the values of a (height, width) raster per zone, ignoring NaN; zones are
+    given in a grid whose origin is (row_off, col_off) pixels before the raster's
+    """
+    out = np.zeros(len(zones), dtype=np.float64)
+    for i, (rows, cols) in enumerate(zones):
+        rows, cols = rows - row_off, cols - col_off
+        inside = (
+            (rows >= 0)
+            & (rows < raster.shape[0])
+            & (cols >= 0)
+            & (cols < raster.shape[1])
+        )
+        out[i] = np.nansum(raster[rows[inside], cols[inside]], dtype=np.float64)
+    return out
+
+
+def get_grid_indices(transform, shape: tuple, other_transform) -> tuple:
+    """
+    Get, for each row and column of a north-up raster grid, the row and column
+    of another north-up grid which contains its pixel centers (may be out of bounds)
+    """
+    xs = transform.c + (np.arange(shape[1]) + 0.5) * transform.a
+    ys = transform.f + (np.arange(shape[0]) + 0.5) * transform.e
+    cols = np.floor((xs - other_transform.c) / other_transform.a).astype(int)
+    rows = np.floor((ys - other_transform.f) / other_transform.e).astype(int)
+    return rows, cols
@@ -124,13 +124,14 @@ class Scenario:
             country_gdf = self.pipe.load.get_adm_boundaries(
                 country=self.country, adm_level=adm_level
             )
+            pcodes = country_gdf[f"adm{adm_level}_pcode"].to_numpy()
             for lead_time in range(0, 8):
-                for ix, row in country_gdf.iterrows():
+                for pcode in pcodes:
                     self.pipe.data.discharge_admin.upsert_data_unit(
                         DischargeDataUnit(
                             adm_level=adm_level,
                             lead_time=lead_time,
-                            pcode=row[f"adm{adm_level}_pcode"],
+                            pcode=pcode,
                             discharge_ensemble=[0.01] * self.noEns,
                         )
                     )
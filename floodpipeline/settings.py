@@ -25,7 +25,7 @@ class Settings:
         with open(self.setting_path, "r") as file:
             self.settings = yaml.load(file, Loader=yaml.FullLoader)
 
-    def get_setting(self, setting: str):
+    def get_setting(self, setting: str, default=None):
         setting_value = None
         if setting in self.settings.keys():
             setting_value = self.settings[setting]
@@ -39,6 +39,8 @@ class Settings:
                         if setting in self.settings[key][i].keys():
                             setting_value = self.settings[key][i][setting]
         if not setting_value:
+            if default is not None:
+                return default
             raise ValueError(f"Setting {setting} not found in {self.setting_path}")
         return setting_value
 
@@ -0,0 +1,74 @@
+import pytest
+from floodpipeline.data import (
+    AdminDataSet,
+    StationDataSet,
+    ForecastDataUnit,
+    ForecastStationDataUnit,
+)
+
+
+def get_admin_data_set() -> AdminDataSet:
+    return AdminDataSet(
+        country="UGA",
+        adm_levels=[1],
+        data_units=[
+            ForecastDataUnit(adm_level=1, pcode=f"UG{i}", lead_time=lead_time)
+            for i in range(3)
+            for lead_time in range(1, 4)
+        ],
+    )
+
+
+def test_get_data_unit_by_pcode_and_lead_time():
+    data_set = get_admin_data_set()
+    data_unit = data_set.get_data_unit("UG1", 2)
+    assert (data_unit.pcode, data_unit.lead_time) == ("UG1", 2)
+    assert data_set.get_data_unit("UG2") is data_set.data_units[6]
+    with pytest.raises(ValueError):
+        data_set.get_data_unit("UG3", 1)
+
+
+def test_get_data_unit_after_changes_in_place():
+    data_set = get_admin_data_set()
+    # replace an item
+    data_unit = ForecastDataUnit(adm_level=1, pcode="UG9", lead_time=1)
+    data_set.data_units[0] = data_unit
+    assert data_set.get_data_unit("UG9", 1) is data_unit
+    with pytest.raises(ValueError):
+        data_set.get_data_unit("UG0", 1)
+    # sort the list
+    data_set.data_units.sort(key=lambda x: (-x.lead_time, x.pcode))
+    assert data_set.get_data_unit("UG1", 2).lead_time == 2
+    # change the key of a data unit
+    data_set.data_units[-1].pcode = "UG7"
+    assert data_set.get_data_unit("UG7", 1) is data_set.data_units[-1]
+    # append a data unit
+    data_unit = ForecastDataUnit(adm_level=1, pcode="UG5", lead_time=1)
+    data_set.data_units.append(data_unit)
+    assert data_set.get_data_unit("UG5", 1) is data_unit
+
+
+def test_upsert_data_unit():
+    data_set = get_admin_data_set()
+    data_unit = ForecastDataUnit(adm_level=1, pcode="UG1", lead_time=3)
+    data_set.upsert_data_unit(data_unit)
+    assert len(data_set.data_units) == 9
+    assert data_set.get_data_unit("UG1", 3) is data_unit
+    data_unit = ForecastDataUnit(adm_level=1, pcode="UG3", lead_time=3)
+    data_set.upsert_data_unit(data_unit)
+    assert len(data_set.data_units) == 10
+    assert data_set.get_data_unit("UG3", 3) is data_unit
+
+
+def test_station_get_data_unit():
+    data_set = StationDataSet(
+        country="UGA",
+        data_units=[
+            ForecastStationDataUnit(station_code=f"G{i}", lead_time=lead_time)
+            for i in range(2)
+            for lead_time in range(0, 3)
+        ],
+    )
+    # lead time 0 is ignored, as before
+    assert data_set.get_data_unit("G1", 0) is data_set.data_units[3]
+    assert data_set.get_data_unit(station_code="G1", lead_time=2).lead_time == 2
@@ -0,0 +1,42 @@
+import netCDF4
+import numpy as np
+import pytest
+from rasterio.transform import from_origin
+from floodpipeline.extract import slice_netcdf_file, get_netcdf_transform
+
+LAT = np.round(np.arange(10, -5, -0.05) - 0.025, 4)
+LON = np.round(np.arange(25, 40, 0.05) + 0.025, 4)
+
+
+@pytest.fixture
+def nc_file(tmp_path):
+    """Global-like GloFAS file with 10 time steps on a 0.05 degree grid"""
+    rng = np.random.default_rng(0)
+    with netCDF4.Dataset(tmp_path / "glofas.nc", "w") as nc_out:
+        nc_out.createDimension("time", 10)
+        nc_out.createDimension("lat", LAT.size)
+        nc_out.createDimension("lon", LON.size)
+        nc_out.createVariable("lat", np.float64, ("lat",))[:] = LAT
+        nc_out.createVariable("lon", np.float64, ("lon",))[:] = LON
+        variable = nc_out.createVariable("dis24", np.float32, ("time", "lat", "lon"))
+        variable[:] = rng.random((10, LAT.size, LON.size)) * 500
+    with netCDF4.Dataset(tmp_path / "glofas.nc") as nc_file:
+        yield nc_file
+
+
+def test_slice_netcdf_file_time_steps(nc_file):
+    var_data, lon, lat = slice_netcdf_file(nc_file, [30.0, 0.0, 31.0, 1.0])
+    assert var_data.shape == (10, lat.size, lon.size)
+    var_data_7, _, _ = slice_netcdf_file(nc_file, [30.0, 0.0, 31.0, 1.0], 7)
+    np.testing.assert_array_equal(var_data_7, var_data[:7])
+
+
+def test_get_netcdf_transform_single_row_and_column(nc_file):
+    # bounds containing a single pixel center in each direction
+    var_data, lon, lat = slice_netcdf_file(nc_file, [30.02, 0.02, 30.03, 0.03])
+    assert var_data.shape == (10, 1, 1)
+    transform = get_netcdf_transform(nc_file, lon, lat)
+    assert transform.almost_equals(from_origin(30.0, 0.05, 0.05, 0.05))
+    var_data, lon, lat = slice_netcdf_file(nc_file, [30.0, 0.0, 31.0, 1.0])
+    transform = get_netcdf_transform(nc_file, lon, lat)
+    assert transform.almost_equals(from_origin(30.0, 1.0, 0.05, 0.05))
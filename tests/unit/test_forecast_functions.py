@@ -0,0 +1,226 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.features import geometry_mask
+from rasterio.merge import merge
+from rasterio.transform import from_origin
+from rasterstats import zonal_stats
+from shapely.geometry import Point, box
+from floodpipeline.forecast import (
+    AFFECTED_NEVER,
+    merge_rasters_to,
+    clip_raster,
+    compute_likelihoods_batch,
+    get_return_period_indices,
+    write_flood_extent,
+    compute_pop_per_zone,
+)
+
+TRANSFORM = from_origin(30.0, 2.0, 0.01, 0.01)
+SHAPE = (200, 250)
+
+
+def write_raster(filepath: str, array: np.ndarray, transform, nodata=None) -> dict:
+    """Write a single-band float32 raster, return its metadata"""
+    meta = {
+        "driver": "GTiff",
+        "height": array.shape[0],
+        "width": array.shape[1],
+        "count": 1,
+        "dtype": "float32",
+        "crs": "EPSG:4326",
+        "transform": transform,
+        "nodata": nodata,
+    }
+    with rasterio.open(filepath, "w", **meta) as dest:
+        dest.write(array.astype(np.float32), 1)
+    return meta
+
+
+def compute_likelihoods_loop(discharge_ensemble: list, thresholds: list) -> list:
+    """Likelihoods as computed per threshold before vectorization"""
+    return [
+        sum(1 if x > threshold["threshold_value"] else 0 for x in discharge_ensemble)
+        / len(discharge_ensemble)
+        for threshold in thresholds
+    ]
+
+
+def test_compute_likelihoods_batch_matches_loop():
+    rng = np.random.default_rng(0)
+    # integer discharges so that some are equal to the thresholds
+    ensembles = rng.integers(0, 20, (40, 51)).astype(float).tolist()
+    thresholds = [
+        [
+            {"return_period": rp, "threshold_value": float(value)}
+            for rp, value in zip([1.5, 2.0, 5.0, 10.0], sorted(rng.integers(0, 20, 4)))
+        ]
+        for _ in ensembles
+    ]
+    likelihoods = compute_likelihoods_batch(ensembles, thresholds)
+    for ensemble, thresholds_, likelihoods_ in zip(ensembles, thresholds, likelihoods):
+        assert likelihoods_.tolist() == compute_likelihoods_loop(ensemble, thresholds_)
+    # ensembles of different sizes are processed one by one
+    likelihoods = compute_likelihoods_batch(
+        [ensembles[0], ensembles[1][:10]], thresholds[:2]
+    )
+    assert likelihoods[1].tolist() == compute_likelihoods_loop(
+        ensembles[1][:10], thresholds[1]
+    )
+    assert compute_likelihoods_batch([], []) == []
+
+
+def get_return_period_loop(likelihood_per_return_period: dict, minimum: float):
+    """Return period as looked up before vectorization"""
+    return next(
+        (
+            key
+            for key, value in reversed(likelihood_per_return_period.items())
+            if value >= minimum
+        ),
+        0.0,
+    )
+
+
+def test_get_return_period_indices_returns_last_threshold():
+    rng = np.random.default_rng(1)
+    # return periods not sorted: the last threshold in order wins, not the largest
+    return_periods = [2.0, 10.0, 5.0, 20.0]
+    likelihoods = list(np.round(rng.random((200, 4)), 1))
+    indices = get_return_period_indices(likelihoods, 0.6)
+    for likelihoods_, index in zip(likelihoods, indices):
+        expected = get_return_period_loop(dict(zip(return_periods, likelihoods_)), 0.6)
+        assert (return_periods[index] if index >= 0 else 0.0) == expected
+    # likelihoods of different sizes are processed one by one
+    indices = get_return_period_indices(
+        [np.array([0.9, 0.7, 0.1]), np.array([0.5, 0.2])], 0.6
+    )
+    assert indices.tolist() == [1, -1]
+
+
+@pytest.mark.parametrize("nodata", [None, -9999.0])
+def test_write_flood_extent_first_division_wins(tmp_path, nodata):
+    rng = np.random.default_rng(2)
+    rp_raster_filepaths = []
+    for rp in [10, 20]:
+        filepath = str(tmp_path / f"flood_map_RP{rp}.tif")
+        write_raster(filepath, rng.random(SHAPE) * rp, TRANSFORM, nodata)
+        rp_raster_filepaths.append(filepath)
+    # overlapping divisions, the first one uses RP20 and the second one RP10
+    zones_rp = [
+        (box(30.3, 0.6, 31.5, 1.7).buffer(0.05), 2),
+        (Point(31.2, 1.0).buffer(0.5), 1),
+        (box(32.0, 0.1, 32.4, 0.5), 2),
+    ]
+    empty_filepath = str(tmp_path / "flood_extent_empty.tif")
+    meta = write_raster(empty_filepath, np.zeros(SHAPE), TRANSFORM, nodata)
+
+    flood_extent_filepath = str(tmp_path / "flood_extent.tif")
+    write_flood_extent(flood_extent_filepath, zones_rp, rp_raster_filepaths, meta)
+    with rasterio.open(flood_extent_filepath) as src:
+        flood_extent = src.read(1)
+
+    # flood extent as computed before: clip per division, merge with the empty raster
+    clipped_filepaths = []
+    for i, (geometry, rp_index) in enumerate(zones_rp):
+        clipped, clipped_meta = clip_raster(
+            rp_raster_filepaths[rp_index - 1], [geometry]
+        )
+        clipped_filepaths.append(str(tmp_path / f"flood_extent_{i}.tif"))
+        with rasterio.open(clipped_filepaths[-1], "w", **clipped_meta) as dest:
+            dest.write(clipped)
+    expected, expected_transform = merge(clipped_filepaths + [empty_filepath])
+    assert expected_transform == TRANSFORM
+    np.testing.assert_array_equal(flood_extent, expected[0])
+
+
+def test_merge_rasters_to_matches_rasterio_merge(tmp_path):
+    rng = np.random.default_rng(3)
+    tiles = []
+    for i, (row_off, col_off) in enumerate([(0, 0), (0, 120), (90, 60)]):
+        array = rng.random((110, 130))
+        array[rng.random(array.shape) < 0.2] = np.nan
+        tiles.append(str(tmp_path / f"tile_{i}.tif"))
+        write_raster(
+            tiles[-1],
+            array,
+            TRANSFORM * rasterio.Affine.translation(col_off, row_off),
+            np.nan,
+        )
+    merged_filepath = str(tmp_path / "merged.tif")
+    merge_rasters_to(tiles, merged_filepath, nan_to_num=True, compress="lzw")
+    expected, expected_transform = merge(tiles)
+    with rasterio.open(merged_filepath) as src:
+        assert src.transform == expected_transform
+        np.testing.assert_array_equal(src.read(), np.nan_to_num(expected))
+
+
+def test_mask_lakes_on_clipped_array(tmp_path):
+    rng = np.random.default_rng(4)
+    array = rng.random(SHAPE)
+    array[:10] = np.nan
+    raster_filepath = str(tmp_path / "flood_map.tif")
+    write_raster(raster_filepath, array, TRANSFORM, np.nan)
+    country = [box(30.5, 0.3, 32.2, 1.97)]
+    lakes = [Point(31.0, 1.0).buffer(0.3), Point(32.0, 1.5).buffer(0.2)]
+
+    # clip and mask lakes in memory, as in add_flood_maps
+    flood_map, flood_map_meta = clip_raster(raster_filepath, country)
+    water = geometry_mask(
+        lakes,
+        out_shape=flood_map.shape[1:],
+        transform=flood_map_meta["transform"],
+        invert=True,
+    )
+    flood_map[:, water] = flood_map_meta["nodata"]
+
+    # clip, save and clip again with inverted mask, as before
+    clipped_filepath = str(tmp_path / "flood_map_clipped.tif")
+    clipped, clipped_meta = clip_raster(raster_filepath, country)
+    with rasterio.open(clipped_filepath, "w", **clipped_meta) as dest:
+        dest.write(clipped)
+    expected, _ = clip_raster(clipped_filepath, lakes, invert=True)
+    np.testing.assert_array_equal(flood_map, expected)
+
+
+def test_compute_pop_per_zone_matches_masked_zonal_stats(tmp_path):
+    rng = np.random.default_rng(5)
+    pop = rng.integers(0, 50, SHAPE).astype(float)
+    pop[rng.random(SHAPE) < 0.05] = -99999.0
+    pop_filepath = str(tmp_path / "population_density.tif")
+    write_raster(pop_filepath, pop, TRANSFORM, -99999.0)
+    geometries = [
+        box(30.1, 0.2, 31.0, 1.1),
+        Point(31.3, 1.2).buffer(0.4),
+        box(31.9, 0.05, 32.45, 0.9),
+    ]
+    # pixels affected from the first or second lead time, cropped
+    affected_since = np.full((80, 120), AFFECTED_NEVER, dtype=np.uint8)
+    affected_since[10:40, 20:70] = 1
+    affected_since[30:70, 60:110] = 0
+    affected_offset = (60, 40)
+    lead_times = [1, 2, 3]
+
+    pop_zones, aff_pop = compute_pop_per_zone(
+        geometries, pop_filepath, affected_since, affected_offset, lead_times
+    )
+
+    pop_valid = np.where(pop == -99999.0, 0.0, pop)
+    expected = zonal_stats(
+        geometries, pop_valid, affine=TRANSFORM, stats=["sum"], all_touched=True
+    )
+    np.testing.assert_array_equal(pop_zones, [stat["sum"] for stat in expected])
+    assert sorted(aff_pop.keys()) == lead_times
+    for index, lead_time in enumerate(lead_times):
+        affected = np.zeros(SHAPE, dtype=bool)
+        affected[60:140, 40:160] = affected_since <= index
+        expected = zonal_stats(
+            geometries,
+            np.where(affected, pop_valid, 0.0),
+            affine=TRANSFORM,
+            stats=["sum"],
+            all_touched=True,
+        )
+        np.testing.assert_array_equal(
+            aff_pop[lead_time], [stat["sum"] for stat in expected]
+        )
@@ -0,0 +1,137 @@
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterstats import zonal_stats
+from shapely.geometry import Point, box
+from floodpipeline.raster import (
+    get_raster_window,
+    get_zone_pixels,
+    zonal_sum,
+    zonal_max,
+    sample_raster,
+    get_grid_indices,
+)
+
+TRANSFORM = from_origin(25.0, 10.0, 0.05, 0.05)
+SHAPE = (300, 300)
+
+
+def get_geometries() -> list:
+    """Boxes whose edges fall on pixel edges, circles, and geometries off the raster"""
+    rng = np.random.default_rng(0)
+    xs, ys = np.linspace(29.6, 35.0, 6), np.linspace(-1.4, 4.2, 6)
+    geometries = [
+        box(xs[i], ys[j], xs[i + 1], ys[j + 1]).buffer(0.03)
+        for i in range(5)
+        for j in range(5)
+    ]
+    geometries += [
+        Point(rng.uniform(24, 41), rng.uniform(-6, 11)).buffer(rng.uniform(0.01, 2))
+        for _ in range(50)
+    ]
+    geometries += [box(10, 10, 11, 11), box(39.5, -5.5, 41, -4.5)]
+    return geometries
+
+
+def test_get_raster_window_pads_and_clips():
+    window = get_raster_window(TRANSFORM, SHAPE, [26.01, 8.01, 26.09, 8.09])
+    assert (window.row_off, window.col_off) == (37, 19)
+    assert (window.height, window.width) == (4, 4)
+    window = get_raster_window(TRANSFORM, SHAPE, [24.0, -6.0, 50.0, 20.0])
+    assert (window.row_off, window.col_off) == (0, 0)
+    assert (window.height, window.width) == SHAPE
+
+
+def test_zonal_sum_matches_rasterstats():
+    rng = np.random.default_rng(1)
+    raster = rng.integers(0, 100, SHAPE).astype(np.float64)
+    geometries = get_geometries()
+    zones = get_zone_pixels(geometries, SHAPE, TRANSFORM)
+    expected = [
+        stat["sum"] or 0.0
+        for stat in zonal_stats(
+            geometries,
+            raster,
+            affine=TRANSFORM,
+            stats=["sum"],
+            all_touched=True,
+            nodata=-1,
+        )
+    ]
+    np.testing.assert_array_equal(zonal_sum(raster, zones), expected)
+
+
+def test_zonal_sum_with_offset():
+    rng = np.random.default_rng(2)
+    raster = rng.random(SHAPE)
+    raster[rng.random(SHAPE) < 0.1] = np.nan
+    zones = get_zone_pixels(get_geometries(), SHAPE, TRANSFORM)
+    row_off, col_off = 40, 70
+    crop = raster[row_off : row_off + 150, col_off : col_off + 100]
+    cropped = np.zeros(SHAPE)
+    cropped[row_off : row_off + 150, col_off : col_off + 100] = crop
+    np.testing.assert_allclose(
+        zonal_sum(crop, zones, row_off, col_off), zonal_sum(cropped, zones)
+    )
+
+
+def test_zonal_max_matches_rasterstats():
+    rng = np.random.default_rng(3)
+    raster = (rng.random((2, *SHAPE)) * 500).astype(np.float32)
+    raster[:, rng.random(SHAPE) < 0.3] = np.nan
+    geometries = get_geometries()
+    zones = get_zone_pixels(geometries, SHAPE, TRANSFORM)
+    maxes = zonal_max(raster, zones)
+    for band in range(raster.shape[0]):
+        expected = [
+            stat["max"] if stat["max"] is not None else 0.0
+            for stat in zonal_stats(
+                geometries,
+                raster[band],
+                affine=TRANSFORM,
+                stats=["max"],
+                all_touched=True,
+                nodata=0.0,
+            )
+        ]
+        np.testing.assert_allclose(maxes[:, band], expected)
+
+
+def test_sample_raster_matches_rasterio(tmp_path):
+    rng = np.random.default_rng(4)
+    raster = (rng.random((3, *SHAPE)) * 500).astype(np.float32)
+    raster[:, 100, 100] = np.nan
+    raster_filepath = str(tmp_path / "raster.tif")
+    with rasterio.open(
+        raster_filepath,
+        "w",
+        driver="GTiff",
+        height=SHAPE[0],
+        width=SHAPE[1],
+        count=3,
+        dtype="float32",
+        transform=TRANSFORM,
+    ) as dest:
+        dest.write(raster)
+    coords = [(30.012, 4.987), (25.0001, 9.9999), (29.999, 5.001), (30.02, 4.98)]
+    with rasterio.open(raster_filepath) as src:
+        expected = np.nan_to_num(np.array(list(src.sample(coords))), nan=0.0)
+    samples = sample_raster(raster, TRANSFORM, coords + [(20.0, 0.0), (30.0, 11.0)])
+    np.testing.assert_array_equal(samples[:4], expected)
+    np.testing.assert_array_equal(samples[4:], 0.0)
+
+
+def test_get_grid_indices_matches_rowcol():
+    transform = from_origin(29.9983, 5.0021, 0.008333, 0.008333)
+    shape = (120, 130)
+    rows, cols = get_grid_indices(transform, shape, TRANSFORM)
+    xs, ys = rasterio.transform.xy(
+        transform, np.zeros(shape[1]), np.arange(shape[1]), offset="center"
+    )
+    _, expected_cols = rasterio.transform.rowcol(TRANSFORM, xs, ys)
+    xs, ys = rasterio.transform.xy(
+        transform, np.arange(shape[0]), np.zeros(shape[0]), offset="center"
+    )
+    expected_rows, _ = rasterio.transform.rowcol(TRANSFORM, xs, ys)
+    np.testing.assert_array_equal(rows, expected_rows)
+    np.testing.assert_array_equal(cols, expected_cols)